@@ -6,11 +6,22 @@
 输入：1张化学图片，输出：文本 + 音频描述
 """
 
-import json
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import itertools
 import os
+import re
+import sqlite3
 import time
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from PIL import Image
 
 # 加载环境变量
 load_dotenv('config.env')
@@ -18,20 +29,196 @@ load_dotenv('config.env')
 # 从环境变量获取API密钥
 API_KEY = os.getenv('OPENAI_API_KEY')
 
+# 使用的模型
+MODEL = "gpt-4o"
+
+# 单个QA对的最大输出token数；合并请求按数据项数放大，但不超过模型的输出上限
+MAX_TOKENS_PER_ITEM = 2000
+MAX_OUTPUT_TOKENS = 16384
+
+# 遇到限流(429)、超时、连接错误和5xx时的最大重试次数（指数退避+随机抖动，遵循Retry-After）
+MAX_RETRIES = 5
+
+# 请求超时（秒）；输出token上限较大的合并请求按最低生成速度(token/秒)放宽，避免生成未完成就超时并被重复计费重试
+REQUEST_TIMEOUT = 60
+MIN_OUTPUT_TOKENS_PER_SECOND = 40
+
+# 原始数据文件（每行包含image_path和text）
+ORIGINAL_DATA_FILE = "test_samples_300.jsonl"
+
+# 原始图片在GitHub上的URL前缀
+GITHUB_IMAGE_BASE_URL = "https://raw.githubusercontent.com/Shize-ZHANG/Any2Any-chemistry/main/original_data/images/"
+
+# 本地原始图片目录，以及预先缩小后的JPEG目录（存在时以base64内联发送，不再让OpenAI从GitHub下载原图）
+LOCAL_IMAGE_DIR = "original_data/images"
+RESIZED_IMAGE_DIR = "original_data/images_resized"
+RESIZED_MAX_SIDE = 1024
+RESIZED_JPEG_QUALITY = 80
+
+# 图片解析精度；化学示意图用"low"通常足够，视觉token约为默认的1/4
+IMAGE_DETAIL = "low"
+
+# QA对输出文件（JSONL，每行一条记录）
+OUTPUT_FILE = "chemistry_qa_pairs.jsonl"
+
+# 每条QA记录必须包含的字段
+REQUIRED_FIELDS = ('domain', 'subdomain', 'id', 'input', 'output')
+
+# 响应无法直接解析时，用于提取其中的JSON对象（如被```json代码块包裹）
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.S)
+
+# 本地响应缓存：相同输入（模型、系统prompt、图片、文本）重复运行时直接复用之前的响应
+CACHE_FILE = ".qa_cache.sqlite3"
+CACHE_EXPIRE_SECONDS = 30 * 86400
+_cache_conn = None
+
+# 固定的系统prompt：所有请求共享同一前缀（超过1024 tokens），可命中OpenAI的自动prompt缓存
+# 随数据变化的内容（ID、文本描述）由create_prompt生成，图片以image_url形式附在用户消息中
+SYSTEM_PROMPT = """You are a multimodal expert specialized in chemistry education. Generate structured JSON data for chemistry-related multimodal question-answer pairs. Always respond with a single valid JSON object.
+
+The user message contains the original data: the chemistry image (image1) is attached, and a JSON object gives the data "id" and the "audio1" text description of the image.
+Based on the original data, please construct a data (Question-Answer pair) entry that strictly conforms to the JSON format below.
+Please design a multimodal interleaved Question-Answer pair. You can place different pieces of information from the original data into the input or output of the Question-Answer pair.
+
+[Question-Answer pair JSON template]
+This Question-Answer pair must adhere to the following structure in the following JSON template and don't generate additional information.
+{
+    "domain": "natural_science",
+    "subdomain": "chemistry",
+    "id": "<DATA_ID>",
+    "input": {
+        "modal": {
+            "image1": "url"
+        },
+        "content": "Interleave <image1> tag at the appropriate position in the text and clearly indicate that the answer must include audio content to support or illustrate the explanation."
+    },
+    "output": {
+        "modal": {
+            "audio1": "text"
+        },
+        "content": "This is the golden annotation answer that the model is expected to generate. Interleave <audio1> tag at suitable position within the text."
+    }
+}
+
+[Construction requirements]
+1 You need to design appropriate question-answer pair and clearly indicate in the question which specific modalities other than text are required to be included in the answer. 
+2 The content of the input is the entire input fed into the model. The question-answer pair should be open-world QA. 
+3 The content of the input is the entire input fed into the model and the content of the output is the golden output of the model. You should design the input content and output content based on the original data.
+4 Give the JSON directly, no additional output information.
+5 The <> tags should be the components of the text sentence, not just a single word. For example, the <> tags can serve as the subject, object, or other components of the sentence.
+6 Please note that the <> tags of the input should not appear in the output.
+7 The <audio1> is a textual description of the <image1> for chemistry education purposes.
+8 Replace <DATA_ID> in the template with the "id" given in the user message.
+9 Keep the literal string "url" as the value of image1; it is replaced with the attached image's URL afterwards.
+
+[IMPORTANT REQUIREMENTS]
+- The input should contain exactly one image (<image1>) showing a chemistry-related diagram, structure, or concept
+- The output should contain exactly one audio description (<audio1>) explaining the chemistry content
+- The audio1 text should be the provided text description, which explains the chemistry concepts shown in the image
+- The question should ask for a detailed audio explanation of the chemistry concepts, structures, or processes shown in the image
+- The answer should naturally reference the audio description using <audio1> tag
+- Focus on educational value and scientific accuracy in chemistry
+- The question should be suitable for chemistry students or educators
+- The audio description should help someone understand the chemical concepts without seeing the image
+
+[Example of good structure]
+Input: Question about chemistry concepts with <image1> asking for audio explanation
+Output: Answer providing <audio1> with detailed chemistry explanation
+
+[Complete example]
+User message (with the resonance structures of carbonate attached as image1):
+{"id":"1","audio1":"The resonance structure includes all three Lewis dot structures with double headed arrows between them."}
+
+Response:
+{
+    "domain": "natural_science",
+    "subdomain": "chemistry",
+    "id": "1",
+    "input": {
+        "modal": {
+            "image1": "url"
+        },
+        "content": "Examine the resonance structures shown in <image1>. Provide a detailed audio explanation of the resonance concept illustrated in the image."
+    },
+    "output": {
+        "modal": {
+            "audio1": "The resonance structure includes all three Lewis dot structures with double headed arrows between them."
+        },
+        "content": "The resonance structures depicted in the image demonstrate how the actual structure of carbonate is a hybrid of these forms. <audio1>"
+    }
+}
+
+Please respond with only the JSON, no additional text or explanation.
+"""
+
+# 合并请求时放在用户消息开头的说明（系统prompt保持不变，仍可命中缓存）
+GROUP_INSTRUCTIONS = """This message contains several independent items. Each item starts with a line "### Item <n>", followed by its JSON data ("id" and "audio1") and its attached image (image1).
+Construct one Question-Answer pair for every item, following all the rules above and using only that item's own image and text.
+Respond with a single JSON object of the form {"results": [<pair for item 1>, <pair for item 2>, ...]} containing exactly one entry per item, in the same order, with each entry's "id" set to its item's id."""
+
+@functools.lru_cache(maxsize=1)
 def load_original_data():
-    """加载原始JSONL数据"""
-    jsonl_file = "test_samples_300.jsonl"
+    """加载原始JSONL数据（同一进程内只解析一次）"""
     try:
-        with open(jsonl_file, 'r', encoding='utf-8') as f:
-            data = [json.loads(line.strip()) for line in f]
+        with open(ORIGINAL_DATA_FILE, 'rb') as f:
+            data = [orjson.loads(line) for line in f]
         return data
     except FileNotFoundError:
-        print(f"❌ 找不到文件: {jsonl_file}")
+        print(f"❌ 找不到文件: {ORIGINAL_DATA_FILE}")
         return []
     except Exception as e:
         print(f"❌ 加载数据失败: {e}")
         return []
 
+def iter_original_data(start_index: int = 0, end_index: int = None):
+    """
+    流式读取原始JSONL数据，只解析指定范围内的行，适用于大文件
+    
+    Args:
+        start_index: 起始索引
+        end_index: 结束索引（包含），为None时读到文件末尾
+        
+    Yields:
+        原始数据项
+    """
+    stop = None if end_index is None else end_index + 1
+    with open(ORIGINAL_DATA_FILE, 'rb') as f:
+        for line in itertools.islice(f, start_index, stop):
+            yield orjson.loads(line)
+
+def get_response_cache() -> sqlite3.Connection:
+    """获取本地响应缓存的数据库连接（首次调用时创建）"""
+    global _cache_conn
+    if _cache_conn is None:
+        # 批量模式下由写入线程写缓存，连接需允许跨线程使用（同一时间只有一处访问）
+        _cache_conn = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+        _cache_conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+    return _cache_conn
+
+def make_cache_key(image_url: str, text_description: str) -> str:
+    """根据模型、系统prompt、图片URL和文本描述计算缓存键"""
+    raw = f"{MODEL}|{SYSTEM_PROMPT}|{image_url}|{text_description}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def load_cached_response(key: str) -> str:
+    """读取未过期的缓存响应，不存在时返回None"""
+    row = get_response_cache().execute(
+        "SELECT response FROM responses WHERE key = ? AND created_at > ?",
+        (key, time.time() - CACHE_EXPIRE_SECONDS)
+    ).fetchone()
+    return row[0] if row else None
+
+def save_cached_response(key: str, response: str):
+    """保存API响应到本地缓存"""
+    conn = get_response_cache()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+            (key, response, time.time())
+        )
+
 def generate_github_url(image_filename: str) -> str:
     """
     根据图片文件名生成GitHub URL
@@ -42,44 +229,167 @@ def generate_github_url(image_filename: str) -> str:
     Returns:
         完整的GitHub URL
     """
-    base_url = "https://raw.githubusercontent.com/Shize-ZHANG/Any2Any-chemistry/main/original_data/images"
-    return f"{base_url}/{image_filename}"
+    return GITHUB_IMAGE_BASE_URL + image_filename
 
-def call_openai_api(prompt: str, image_url: str) -> str:
+def resized_image_path(image_url: str) -> str:
     """
-    调用OpenAI API，支持多模态输入
+    根据图片URL得到预先缩小的本地JPEG路径
+    
+    Args:
+        image_url: 图片的GitHub URL
+        
+    Returns:
+        RESIZED_IMAGE_DIR下同名的.jpg路径（不保证存在）
+    """
+    stem = os.path.splitext(os.path.basename(image_url))[0]
+    return os.path.join(RESIZED_IMAGE_DIR, stem + ".jpg")
+
+def build_image_content(image_url: str) -> dict:
+    """
+    构建消息中的图片部分；有预先缩小的本地JPEG时以base64内联，否则仍使用GitHub URL
+    
+    Args:
+        image_url: 图片的GitHub URL
+        
+    Returns:
+        image_url类型的消息内容
+    """
+    resized_path = resized_image_path(image_url)
+    if os.path.exists(resized_path):
+        with open(resized_path, "rb") as f:
+            url = "data:image/jpeg;base64," + base64.b64encode(f.read()).decode("ascii")
+    else:
+        url = image_url
+    return {"type": "image_url", "image_url": {"url": url, "detail": IMAGE_DETAIL}}
+
+def resize_images(src_dir: str = LOCAL_IMAGE_DIR, dst_dir: str = RESIZED_IMAGE_DIR):
+    """
+    一次性把原始图片缩小为最长边不超过RESIZED_MAX_SIDE的JPEG，已存在的跳过
+    
+    Args:
+        src_dir: 原始图片目录
+        dst_dir: 输出目录
+    """
+    if not os.path.isdir(src_dir):
+        print(f"❌ 找不到图片目录: {src_dir}")
+        return
+    
+    os.makedirs(dst_dir, exist_ok=True)
+    resized_count = 0
+    error_count = 0
+    original_bytes = 0
+    resized_bytes = 0
+    
+    for filename in sorted(os.listdir(src_dir)):
+        src_path = os.path.join(src_dir, filename)
+        dst_path = os.path.join(dst_dir, os.path.splitext(filename)[0] + ".jpg")
+        if not os.path.isfile(src_path) or os.path.exists(dst_path):
+            continue
+        
+        try:
+            with Image.open(src_path) as img:
+                # 先转为RGB再缩小：调色板(P)和二值(1)图片PIL只能用最近邻缩放，细线和文字会锯齿或丢失
+                # JPEG不支持透明通道，透明部分铺白底
+                if img.mode in ("RGBA", "LA", "P"):
+                    img = img.convert("RGBA")
+                    background = Image.new("RGB", img.size, (255, 255, 255))
+                    background.paste(img, mask=img.getchannel("A"))
+                    img = background
+                elif img.mode != "RGB":
+                    img = img.convert("RGB")
+                img.thumbnail((RESIZED_MAX_SIDE, RESIZED_MAX_SIDE))
+                img.save(dst_path, "JPEG", quality=RESIZED_JPEG_QUALITY, optimize=True)
+            original_bytes += os.path.getsize(src_path)
+            resized_bytes += os.path.getsize(dst_path)
+            resized_count += 1
+        except Exception as e:
+            print(f"   ❌ {filename}: {e}")
+            error_count += 1
+    
+    print(f"✅ 缩小了 {resized_count} 张图片, 失败 {error_count} 张")
+    if resized_count:
+        print(f"📦 {original_bytes / 1024 / 1024:.1f} MB -> {resized_bytes / 1024 / 1024:.1f} MB")
+    print(f"📁 输出目录: {dst_dir}")
+
+def create_client(concurrency: int = 16) -> AsyncOpenAI:
+    """
+    创建AsyncOpenAI客户端，整个运行期间复用同一个连接池
+    
+    可重试的错误由客户端自动退避重试，无需在请求之间固定等待
+    
+    Args:
+        concurrency: 最大并发请求数，用于设置连接池大小
+        
+    Returns:
+        配置好连接池的AsyncOpenAI客户端
+    """
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_keepalive_connections=concurrency, max_connections=concurrency),
+        timeout=REQUEST_TIMEOUT
+    )
+    return AsyncOpenAI(api_key=API_KEY, http_client=http_client, max_retries=MAX_RETRIES)
+
+def build_request_body(prompt: str, image_url: str) -> dict:
+    """
+    构建chat completions请求体，实时调用和Batch API共用
     
     Args:
         prompt: 发送的文本prompt
         image_url: 图片URL
         
     Returns:
-        API返回的响应
+        请求参数字典
     """
-    client = OpenAI(api_key=API_KEY)
+    # 构建消息内容，包含文本和图片
+    content = [
+        {"type": "text", "text": prompt},
+        build_image_content(image_url)
+    ]
     
-    try:
-        # 构建消息内容，包含文本和图片
-        content = [
-            {"type": "text", "text": prompt},
-            {"type": "image_url", "image_url": {"url": image_url}}
-        ]
+    return build_chat_body(content)
+
+def build_chat_body(content: list, max_tokens: int = MAX_TOKENS_PER_ITEM) -> dict:
+    """
+    构建带固定系统prompt的chat completions请求体
+    
+    Args:
+        content: 用户消息内容（文本和图片块）
+        max_tokens: 最大输出token数
         
-        response = client.chat.completions.create(
-            model="gpt-4o",  # GPT-4o 模型
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a multimodal expert specialized in chemistry education. Generate structured JSON data for chemistry-related multimodal question-answer pairs. Always respond with properly formatted, multi-line JSON that is easy to read."
-                },
-                {
-                    "role": "user", 
-                    "content": content
-                }
-            ],
-            max_tokens=2000,
-            response_format={"type": "json_object"}  # 强制输出JSON格式
-        )
+    Returns:
+        请求参数字典
+    """
+    return {
+        "model": MODEL,
+        "messages": [
+            {
+                "role": "system", 
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user", 
+                "content": content
+            }
+        ],
+        "max_tokens": max_tokens,
+        "response_format": {"type": "json_object"}  # 强制输出JSON格式
+    }
+
+async def call_openai_api(client: AsyncOpenAI, request_body: dict) -> str:
+    """
+    调用OpenAI API，支持多模态输入
+    
+    Args:
+        client: 共享的AsyncOpenAI客户端
+        request_body: build_request_body或build_group_request_body构建的请求体
+        
+    Returns:
+        API返回的响应
+    """
+    try:
+        # 超时随max_tokens放大，只作用于本次请求（请求体还要写入Batch API文件，不能放进请求体）
+        timeout = max(REQUEST_TIMEOUT, request_body['max_tokens'] / MIN_OUTPUT_TOKENS_PER_SECOND)
+        response = await client.chat.completions.create(**request_body, timeout=timeout)
         
         return response.choices[0].message.content.strip()
         
@@ -87,156 +397,401 @@ def call_openai_api(prompt: str, image_url: str) -> str:
         print(f"❌ API调用失败: {str(e)}")
         return None
 
-def create_prompt(image_url: str, text_description: str, data_id: str) -> str:
+def create_prompt(text_description: str, data_id: str) -> str:
     """
-    创建prompt，用于生成文+图到文+音的化学QA对
+    创建prompt中随数据变化的部分，固定的生成规则见SYSTEM_PROMPT
+    
+    图片已通过image_url附在消息中，这里不再重复图片URL
     
     Args:
-        image_url: 图片URL
         text_description: 文本描述（作为音频内容）
         data_id: 数据ID
         
     Returns:
-        完整的prompt
+        用户消息中的prompt
     """
-    original_data = {
-        "image1": image_url,
-        "audio1": text_description
-    }
-    
-    prompt = f"""You are a multimodal expert. Based on the following original data, please construct a data (Question-Answer pair) entry that strictly conforms to the JSON format below.
-Please design a multimodal interleaved Question-Answer pair. You can place different pieces of information from the original data into the input or output of the Question-Answer pair.
-
-[Original data]
-{json.dumps(original_data, indent=2, ensure_ascii=False)}
-
-[Question-Answer pair JSON template]
-This Question-Answer pair must adhere to the following structure in the following JSON template and don't generate additional information.
-{{
-    "domain": "natural_science",
-    "subdomain": "chemistry",
-    "id": "{data_id}",
-    "input": {{
-        "modal": {{
-            "image1": "url"
-        }},
-        "content": "Interleave <image1> tag at the appropriate position in the text and clearly indicate that the answer must include audio content to support or illustrate the explanation."
-    }},
-    "output": {{
-        "modal": {{
-            "audio1": "text"
-        }},
-        "content": "This is the golden annotation answer that the model is expected to generate. Interleave <audio1> tag at suitable position within the text."
-    }}
-}}
-
-[Construction requirements]
-1 You need to design appropriate question-answer pair and clearly indicate in the question which specific modalities other than text are required to be included in the answer. 
-2 The content of the input is the entire input fed into the model. The question-answer pair should be open-world QA. 
-3 The content of the input is the entire input fed into the model and the content of the output is the golden output of the model. You should design the input content and output content based on the original data.
-4 Give the JSON directly, no additional output information.
-5 The <> tags should be the components of the text sentence, not just a single word. For example, the <> tags can serve as the subject, object, or other components of the sentence.
-6 Please note that the <> tags of the input should not appear in the output.
-7 The <audio1> is a textual description of the <image1> for chemistry education purposes.
-
-[IMPORTANT REQUIREMENTS]
-- The input should contain exactly one image (<image1>) showing a chemistry-related diagram, structure, or concept
-- The output should contain exactly one audio description (<audio1>) explaining the chemistry content
-- The audio1 text should be the provided text description, which explains the chemistry concepts shown in the image
-- The question should ask for a detailed audio explanation of the chemistry concepts, structures, or processes shown in the image
-- The answer should naturally reference the audio description using <audio1> tag
-- Focus on educational value and scientific accuracy in chemistry
-- The question should be suitable for chemistry students or educators
-- The audio description should help someone understand the chemical concepts without seeing the image
-
-[Example of good structure]
-Input: Question about chemistry concepts with <image1> asking for audio explanation
-Output: Answer providing <audio1> with detailed chemistry explanation
-
-Please respond with only the JSON, no additional text or explanation.
-"""
+    return orjson.dumps({"id": data_id, "audio1": text_description}).decode()
 
-    return prompt
-
-def process_single_item(data_item: dict, data_id: str, delay: int = 2) -> bool:
+def build_group_request_body(items: list) -> dict:
     """
-    处理单个数据项的QA对生成
+    构建合并多个数据项的请求体，每个数据项带有自己的ID、文本描述和图片
     
     Args:
-        data_item: 包含image_path和text的数据项
-        data_id: 数据ID
-        delay: API调用间隔延迟(秒)
+        items: (data_id, image_url, text_description) 列表
         
     Returns:
-        是否成功
+        请求参数字典，模型返回 {"results": [...]}
     """
-    print(f"\n🔄 处理ID: {data_id}")
+    content = [{"type": "text", "text": GROUP_INSTRUCTIONS}]
+    for n, (data_id, image_url, text_description) in enumerate(items, 1):
+        content.append({"type": "text", "text": f"### Item {n}\n{create_prompt(text_description, data_id)}"})
+        content.append(build_image_content(image_url))
     
-    # 提取图片文件名和生成URL
-    image_path = data_item['image_path']
-    image_filename = os.path.basename(image_path)
-    image_url = generate_github_url(image_filename)
-    text_description = data_item['text']
+    return build_chat_body(content, min(MAX_TOKENS_PER_ITEM * len(items), MAX_OUTPUT_TOKENS))
+
+def split_group_response(response: str, data_ids: list) -> list:
+    """
+    将合并请求的响应按ID拆分为每个数据项各自的响应
     
-    print(f"   📷 图片URL: {image_url}")
-    print(f"   📝 文本长度: {len(text_description)} 字符")
+    Args:
+        response: API返回的响应，调用失败时为None
+        data_ids: 请求中各数据项的ID
+        
+    Returns:
+        与data_ids顺序对应的响应列表，缺失或无法解析的项为None
+    """
+    try:
+        results = parse_json_response(response).get('results') if response else None
+    except (orjson.JSONDecodeError, AttributeError):
+        results = None
+    if not isinstance(results, list):
+        return [None] * len(data_ids)
     
-    # 创建prompt
-    prompt = create_prompt(image_url, text_description, data_id)
+    by_id = {str(result.get('id')): result for result in results if isinstance(result, dict)}
+    return [
+        orjson.dumps(by_id[data_id]).decode() if data_id in by_id else None
+        for data_id in data_ids
+    ]
+
+def parse_json_response(response: str) -> dict:
+    """
+    解析API响应中的JSON
+    
+    请求使用了response_format=json_object，正常情况下可直接解析；
+    失败时再尝试提取响应中第一个{到最后一个}之间的内容
     
-    # 调用API
-    print(f"   📤 调用OpenAI API...")
-    response = call_openai_api(prompt, image_url)
+    Args:
+        response: API返回的响应
+        
+    Returns:
+        解析后的字典，无法解析时抛出orjson.JSONDecodeError
+    """
+    try:
+        return orjson.loads(response)
+    except orjson.JSONDecodeError:
+        match = _JSON_OBJECT_RE.search(response)
+        if not match:
+            raise
+        return orjson.loads(match.group(0))
+
+def save_response(response: str, data_id: str, image_url: str, out_f, cache_key: str = None) -> bool:
+    """
+    解析API响应并追加保存QA对，失败时写入错误日志
     
+    Args:
+        response: API返回的响应，调用失败时为None
+        data_id: 数据ID
+        image_url: 图片URL，填入input的image1
+        out_f: 已打开的输出文件（二进制追加模式）
+        cache_key: 解析成功后写入本地缓存的键，为None时不写缓存
+        
+    Returns:
+        是否成功
+    """
     if response:
         try:
-            # 清理响应
-            cleaned_response = response.strip()
-            if cleaned_response.startswith('```json'):
-                cleaned_response = cleaned_response[7:]
-            if cleaned_response.endswith('```'):
-                cleaned_response = cleaned_response[:-3]
-            cleaned_response = cleaned_response.strip()
+            qa_pair = parse_json_response(response)
+            # 模型可能返回结构不对的JSON（如input为字符串），按解析失败处理
+            if not isinstance(qa_pair, dict) or not isinstance(qa_pair.get('input'), dict) \
+                    or not isinstance(qa_pair['input'].get('modal'), dict):
+                raise ValueError("响应结构不符合要求: 缺少input.modal对象")
+            
+            # 缓存键不包含ID，统一使用当前数据的ID；prompt中没有图片URL，由这里填入
+            qa_pair['id'] = data_id
+            qa_pair['input']['modal']['image1'] = image_url
             
-            qa_pair = json.loads(cleaned_response)
+            if cache_key:
+                save_cached_response(cache_key, response)
             
-            # 保存到JSONL文件（格式化的多行JSON）
-            output_file = "chemistry_qa_pairs.jsonl"
-            with open(output_file, "a", encoding="utf-8") as f:
-                # 写入格式化的JSON，每个case占多行，便于阅读
-                formatted_json = json.dumps(qa_pair, ensure_ascii=False, indent=2)
-                f.write(formatted_json + "\n")
+            # 保存到JSONL文件（每条记录一行）
+            out_f.write(orjson.dumps(qa_pair) + b"\n")
             
-            print(f"   ✅ 成功生成化学QA对，已保存")
+            print(f"   ✅ ID {data_id}: 成功生成化学QA对，已保存")
             return True
             
-        except json.JSONDecodeError as e:
-            print(f"   ❌ JSON解析失败: {e}")
+        except (orjson.JSONDecodeError, ValueError) as e:
+            print(f"   ❌ ID {data_id}: JSON解析失败: {e}")
             # 保存原始响应到错误日志
             with open("chemistry_error_log.txt", "a", encoding="utf-8") as f:
                 f.write(f"ID: {data_id}\nError: {e}\nResponse: {response}\n{'='*50}\n")
             return False
             
     else:
-        print(f"   ❌ API调用失败")
+        print(f"   ❌ ID {data_id}: API调用失败")
         # 记录错误
         with open("chemistry_error_log.txt", "a", encoding="utf-8") as f:
             f.write(f"ID: {data_id}\nError: API调用失败\n{'='*50}\n")
         return False
 
-def batch_process(start_index: int = 0, end_index: int = 10, delay: int = 2):
+def prepare_batch(start_index: int, end_index: int) -> list:
+    """
+    流式读取处理范围内的原始数据，预先计算每个数据项的ID、图片URL和文本描述
+    
+    Args:
+        start_index: 起始索引
+        end_index: 结束索引（包含）
+        
+    Returns:
+        (data_id, image_url, text_description) 列表，ID从1开始；读取失败时返回空列表
+    """
+    try:
+        return [
+            (str(i + 1), generate_github_url(os.path.basename(data_item['image_path'])), data_item['text'])
+            for i, data_item in enumerate(iter_original_data(start_index, end_index), start_index)
+        ]
+    except FileNotFoundError:
+        print(f"❌ 找不到文件: {ORIGINAL_DATA_FILE}")
+        return []
+    except Exception as e:
+        print(f"❌ 加载数据失败: {e}")
+        return []
+
+def resolve_custom_id(custom_id: str, groups: dict) -> tuple:
+    """
+    根据batch结果的custom_id找到对应的数据项
+    
+    恢复轮询时传入的处理范围可能与提交时不同，不在本次范围内的ID按原始数据重新构建
+    
+    Args:
+        custom_id: 提交时的custom_id（数据ID，从1开始）
+        groups: 本次范围内 {custom_id: (data_ids, image_url, cache_key)}
+        
+    Returns:
+        (data_ids, image_url, cache_key)，无法识别时返回None
+    """
+    if custom_id in groups:
+        return groups[custom_id]
+    if not custom_id.isdigit() or int(custom_id) < 1:
+        return None
+    
+    batch = prepare_batch(int(custom_id) - 1, int(custom_id) - 1)
+    if not batch:
+        return None
+    data_id, image_url, text_description = batch[0]
+    return [data_id], image_url, make_cache_key(image_url, text_description)
+
+def partition_cached(batch: list) -> tuple:
+    """
+    按本地缓存将批次拆分为已缓存和待请求两部分
+    
+    Args:
+        batch: prepare_batch返回的列表
+        
+    Returns:
+        (cached, pending)：cached为 (data_id, image_url, response) 列表，
+        pending为 (data_id, image_url, text_description, cache_key) 列表
+    """
+    cached = []
+    pending = []
+    for data_id, image_url, text_description in batch:
+        cache_key = make_cache_key(image_url, text_description)
+        response = load_cached_response(cache_key)
+        if response is not None:
+            cached.append((data_id, image_url, response))
+        else:
+            pending.append((data_id, image_url, text_description, cache_key))
+    return cached, pending
+
+def group_duplicates(pending: list) -> list:
+    """
+    合并图片URL和文本描述完全相同的待请求数据项，每组只需请求一次
+    
+    Args:
+        pending: partition_cached返回的待请求列表
+        
+    Returns:
+        (data_ids, image_url, text_description, cache_key) 列表，保持首次出现的顺序
+    """
+    # 缓存键由图片URL和文本描述计算，相同输入的缓存键相同
+    groups = {}
+    for data_id, image_url, text_description, cache_key in pending:
+        if cache_key in groups:
+            groups[cache_key][0].append(data_id)
+        else:
+            groups[cache_key] = ([data_id], image_url, text_description, cache_key)
+    return list(groups.values())
+
+async def preflight_images(image_urls: list, concurrency: int = 16) -> dict:
     """
-    批量处理多个化学数据项
+    并发发送HEAD请求检查图片URL是否可访问
+    
+    Args:
+        image_urls: 图片URL列表
+        concurrency: 最大并发连接数
+        
+    Returns:
+        {url: 失败原因}，可访问的URL不在结果中
+    """
+    limits = httpx.Limits(max_keepalive_connections=concurrency, max_connections=concurrency)
+    # 连接池排队等待不计入超时，只限制单个请求
+    timeout = httpx.Timeout(10, pool=None)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True) as http_client:
+        responses = await asyncio.gather(*(http_client.head(url) for url in image_urls), return_exceptions=True)
+    
+    failures = {}
+    for url, response in zip(image_urls, responses):
+        if isinstance(response, Exception):
+            failures[url] = f"图片无法访问: {response!r}"
+        elif response.status_code != 200:
+            failures[url] = f"图片无法访问: HTTP {response.status_code}"
+    return failures
+
+async def drop_unreachable_images(groups: list, concurrency: int = 16) -> tuple:
+    """
+    预检待请求数据项的图片，去掉图片无法访问的组并写入错误日志，避免为其消耗API token
+    
+    Args:
+        groups: group_duplicates返回的列表
+        concurrency: 预检的最大并发连接数
+        
+    Returns:
+        (可访问的组列表, 被跳过的数据项数)
+    """
+    # 有本地缩小副本的图片以base64内联发送，无需检查GitHub URL
+    remote_urls = [group[1] for group in groups if not os.path.exists(resized_image_path(group[1]))]
+    failures = await preflight_images(remote_urls, concurrency) if remote_urls else {}
+    if not failures:
+        return groups, 0
+    
+    reachable = []
+    skipped_count = 0
+    with open("chemistry_error_log.txt", "a", encoding="utf-8") as f:
+        for group in groups:
+            data_ids, image_url = group[0], group[1]
+            if image_url not in failures:
+                reachable.append(group)
+                continue
+            print(f"   ❌ ID {', '.join(data_ids)}: {failures[image_url]}")
+            for data_id in data_ids:
+                f.write(f"ID: {data_id}\nError: {failures[image_url]}\nURL: {image_url}\n{'='*50}\n")
+            skipped_count += len(data_ids)
+    return reachable, skipped_count
+
+def save_response_for_ids(response: str, data_ids: list, image_url: str, out_f, cache_key: str = None) -> list:
+    """
+    将同一个响应保存为多个ID的QA对（相同输入的数据项共享一次请求的结果）
+    
+    Returns:
+        每个ID是否成功的列表
+    """
+    return [
+        save_response(response, data_id, image_url, out_f, cache_key if i == 0 else None)
+        for i, data_id in enumerate(data_ids)
+    ]
+
+async def request_qa_pair(client: AsyncOpenAI, data_ids: list, image_url: str, text_description: str,
+                          cache_key: str, queue: asyncio.Queue):
+    """
+    调用API生成QA对，并将响应放入写入队列，相同输入的多个ID只请求一次
+    
+    Args:
+        client: 共享的AsyncOpenAI客户端
+        data_ids: 共享同一输入的数据ID列表
+        image_url: 图片URL
+        text_description: 文本描述（作为音频内容）
+        cache_key: 本地缓存键
+        queue: 由write_responses消费的写入队列
+    """
+    # 构建请求体时需要读取并base64编码图片，放到线程中执行以免阻塞其他请求
+    request_body = await asyncio.to_thread(build_request_body, create_prompt(text_description, data_ids[0]), image_url)
+    response = await call_openai_api(client, request_body)
+    await queue.put((response, data_ids, image_url, cache_key))
+
+async def request_qa_pair_group(client: AsyncOpenAI, groups: list, queue: asyncio.Queue):
+    """
+    在一次API调用中为多组输入生成QA对，拆分后逐组放入写入队列
+    
+    Args:
+        client: 共享的AsyncOpenAI客户端
+        groups: group_duplicates返回的 (data_ids, image_url, text_description, cache_key) 列表
+        queue: 由write_responses消费的写入队列
+    """
+    items = [(data_ids[0], image_url, text_description) for data_ids, image_url, text_description, _ in groups]
+    request_body = await asyncio.to_thread(build_group_request_body, items)
+    response = await call_openai_api(client, request_body)
+    
+    # 每组单独写缓存，之后的运行仍可按单个数据项命中
+    item_responses = split_group_response(response, [item[0] for item in items])
+    for (data_ids, image_url, _, cache_key), item_response in zip(groups, item_responses):
+        if response and item_response is None:
+            print(f"   ⚠️  ID {data_ids[0]}: 合并请求的响应中缺少该项")
+        await queue.put((item_response, data_ids, image_url, cache_key))
+
+async def write_responses(queue: asyncio.Queue, out_f) -> list:
+    """
+    写入协程：从队列中取出响应并保存，直到取到None
+    
+    解析、写缓存和写文件在线程中执行，磁盘I/O不会阻塞正在等待API的请求
+    
+    Args:
+        queue: request_qa_pair写入的队列
+        out_f: 已打开的输出文件（二进制追加模式）
+        
+    Returns:
+        每个ID是否成功的列表
+    """
+    results = []
+    while (item := await queue.get()) is not None:
+        response, data_ids, image_url, cache_key = item
+        try:
+            results += await asyncio.to_thread(save_response_for_ids, response, data_ids, image_url, out_f, cache_key)
+        except Exception as e:
+            # 写入协程退出会导致请求协程阻塞在队列上，单条出错只记为失败
+            print(f"   ❌ ID {', '.join(data_ids)}: 保存失败: {e}")
+            results += [False] * len(data_ids)
+    return results
+
+async def process_single_item(data_item: dict, data_id: str) -> bool:
+    """
+    单次处理模式：处理单个数据项的QA对生成
+    
+    Args:
+        data_item: 包含image_path和text的数据项
+        data_id: 数据ID
+        
+    Returns:
+        是否成功
+    """
+    print(f"\n🔄 处理ID: {data_id}")
+    
+    # 提取图片文件名和生成URL
+    image_url = generate_github_url(os.path.basename(data_item['image_path']))
+    text_description = data_item['text']
+    
+    print(f"   📷 图片URL: {image_url}")
+    print(f"   📝 文本长度: {len(text_description)} 字符")
+    
+    cached, pending = partition_cached([(data_id, image_url, text_description)])
+    
+    with open(OUTPUT_FILE, "ab") as out_f:
+        # 优先使用本地缓存，未命中时再调用API
+        if cached:
+            print(f"   💾 命中本地缓存，跳过API调用")
+            return save_response(cached[0][2], data_id, image_url, out_f)
+        
+        print(f"   📤 调用OpenAI API...")
+        async with create_client(concurrency=1) as client:
+            request_body = await asyncio.to_thread(build_request_body, create_prompt(text_description, data_id), image_url)
+            response = await call_openai_api(client, request_body)
+        return save_response(response, data_id, image_url, out_f, pending[0][3])
+
+async def batch_process(start_index: int = 0, end_index: int = 10, concurrency: int = 16, rpm: int = 500,
+                        group_size: int = 1, preflight: bool = True):
+    """
+    批量并发处理多个化学数据项
     
     Args:
         start_index: 起始索引
         end_index: 结束索引
-        delay: API调用间隔延迟(秒)
+        concurrency: 最大并发请求数
+        rpm: 每分钟最大请求数
+        group_size: 每次API调用合并处理的数据项数，1表示每项单独请求
+        preflight: 调用API前是否先检查图片URL可访问
     """
     print("🧪 化学QA对批量生成脚本")
     print("=" * 50)
     print(f"🎯 处理范围: 索引 {start_index} 到 {end_index}")
-    print(f"⏱️  API延迟: {delay}秒")
+    print(f"⚡ 并发数: {concurrency}, 速率限制: {rpm} 次/分钟, 每次请求 {group_size} 项")
     print(f"📥 输入模式: 1张化学图片 + 文本描述")
     print(f"📤 输出模式: 文本问题 + 音频描述")
     print("=" * 50)
@@ -246,42 +801,218 @@ def batch_process(start_index: int = 0, end_index: int = 10, delay: int = 2):
         print("❌ 请在config.env文件中设置OPENAI_API_KEY环境变量")
         return
     
-    # 加载原始数据
-    original_data = load_original_data()
-    if not original_data:
+    # 只读取处理范围内的原始数据
+    batch = prepare_batch(start_index, end_index)
+    if not batch:
         print("❌ 无法加载原始数据")
         return
     
-    print(f"📊 加载了 {len(original_data)} 条原始数据")
+    print(f"📊 加载了 {len(batch)} 条原始数据")
     
-    # 调整结束索引
-    end_index = min(end_index, len(original_data) - 1)
+    # 预先准备好所有输入，命中缓存的数据项不占用并发和限流额度，相同输入只请求一次
+    cached, pending = partition_cached(batch)
+    groups = group_duplicates(pending)
+    print(f"💾 命中本地缓存: {len(cached)} 个, 待请求: {len(pending)} 个 (去重后 {len(groups)} 个)")
     
-    success_count = 0
-    error_count = 0
+    # 图片无法访问的数据项直接记为失败，不再调用API
+    skipped_count = 0
+    if preflight and groups:
+        groups, skipped_count = await drop_unreachable_images(groups, concurrency)
     
-    # 批量处理
-    for i in range(start_index, end_index + 1):
-        data_id = str(i + 1)  # ID从1开始
-        data_item = original_data[i]
+    # 信号量限制同时在途的请求数，AsyncLimiter限制每分钟请求数
+    sem = asyncio.Semaphore(concurrency)
+    limiter = AsyncLimiter(rpm, 60)
+    
+    # 输出文件在整个批次中只打开一次
+    with open(OUTPUT_FILE, "ab", buffering=1 << 16) as out_f:
+        results = [
+            save_response(response, data_id, image_url, out_f)
+            for data_id, image_url, response in cached
+        ]
+        results += [False] * skipped_count
         
-        success = process_single_item(data_item, data_id, delay)
-        if success:
-            success_count += 1
-        else:
-            error_count += 1
+        # 请求协程把响应放入有界队列（满时反压），由单独的写入协程落盘
+        queue = asyncio.Queue(maxsize=64)
+        writer = asyncio.create_task(write_responses(queue, out_f))
         
-        # 添加延迟以避免API限制（除了最后一个）
-        if i < end_index:
-            print(f"   ⏳ 等待{delay}秒后继续...")
-            time.sleep(delay)
+        try:
+            async with create_client(concurrency) as client:
+                async def bounded(coro):
+                    async with sem:
+                        async with limiter:
+                            return await coro
+                
+                if group_size > 1:
+                    tasks = [
+                        bounded(request_qa_pair_group(client, groups[i:i + group_size], queue))
+                        for i in range(0, len(groups), group_size)
+                    ]
+                else:
+                    tasks = [bounded(request_qa_pair(client, *group, queue)) for group in groups]
+                await asyncio.gather(*tasks)
+        finally:
+            # 即使某个请求协程出错，也要等写入协程把已返回的响应全部落盘
+            await queue.put(None)
+            results += await writer
+    
+    success_count = sum(1 for success in results if success)
+    error_count = len(results) - success_count
     
     # 输出统计信息
     print(f"\n{'='*50}")
     print(f"📊 处理完成!")
     print(f"✅ 成功: {success_count} 个")
     print(f"❌ 失败: {error_count} 个")
-    print(f"📁 输出文件: chemistry_qa_pairs.jsonl")
+    print(f"📁 输出文件: {OUTPUT_FILE}")
+    if error_count > 0:
+        print(f"📝 错误日志: chemistry_error_log.txt")
+    print(f"{'='*50}")
+
+async def batch_process_offline(start_index: int = 0, end_index: int = 10, batch_id: str = None, poll_interval: int = 60,
+                                preflight: bool = True):
+    """
+    通过OpenAI Batch API离线批量处理（费用约为实时调用的一半，24小时内完成）
+    
+    Args:
+        start_index: 起始索引
+        end_index: 结束索引
+        batch_id: 已提交的batch ID，传入时跳过提交，直接继续轮询
+        poll_interval: 轮询batch状态的间隔(秒)
+        preflight: 提交前是否先检查图片URL可访问
+    """
+    print("🧪 化学QA对离线批量生成 (OpenAI Batch API)")
+    print("=" * 50)
+    print(f"🎯 处理范围: 索引 {start_index} 到 {end_index}")
+    print("=" * 50)
+    
+    # 检查API密钥
+    if not API_KEY:
+        print("❌ 请在config.env文件中设置OPENAI_API_KEY环境变量")
+        return
+    
+    # 只读取处理范围内的原始数据
+    batch = prepare_batch(start_index, end_index)
+    if not batch:
+        print("❌ 无法加载原始数据")
+        return
+    
+    # 构建请求，已缓存的数据项无需提交，相同输入只提交一次（custom_id为组内第一个ID）
+    cached, pending = partition_cached(batch)
+    grouped = group_duplicates(pending)
+    skipped_count = 0
+    if preflight and grouped and batch_id is None:
+        grouped, skipped_count = await drop_unreachable_images(grouped)
+    groups = {data_ids[0]: (data_ids, image_url, cache_key) for data_ids, image_url, _, cache_key in grouped}
+    batch_requests = [
+        {
+            "custom_id": data_ids[0],
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": build_request_body(create_prompt(text_description, data_ids[0]), image_url)
+        }
+        for data_ids, image_url, text_description, _ in grouped
+    ]
+    
+    print(f"💾 命中本地缓存: {len(cached)} 个, 待提交: {len(batch_requests)} 个")
+    
+    result_lines = []
+    if batch_requests or batch_id:
+        async with create_client() as client:
+            if batch_id is None:
+                # 写入请求文件并提交batch
+                requests_file = "chemistry_batch_requests.jsonl"
+                with open(requests_file, "wb") as f:
+                    for request in batch_requests:
+                        f.write(orjson.dumps(request) + b"\n")
+                
+                with open(requests_file, "rb") as f:
+                    batch_file = await client.files.create(file=f, purpose="batch")
+                batch_job = await client.batches.create(
+                    input_file_id=batch_file.id,
+                    endpoint="/v1/chat/completions",
+                    completion_window="24h"
+                )
+                print(f"📤 已提交 {len(batch_requests)} 个请求, batch ID: {batch_job.id}")
+            else:
+                batch_job = await client.batches.retrieve(batch_id)
+                print(f"🔁 继续轮询 batch ID: {batch_job.id}")
+            
+            # 轮询直到batch结束
+            while batch_job.status not in ("completed", "failed", "expired", "cancelled"):
+                counts = batch_job.request_counts
+                if counts:
+                    print(f"   ⏳ 状态: {batch_job.status} ({counts.completed}/{counts.total})，{poll_interval}秒后重试...")
+                else:
+                    print(f"   ⏳ 状态: {batch_job.status}，{poll_interval}秒后重试...")
+                await asyncio.sleep(poll_interval)
+                batch_job = await client.batches.retrieve(batch_job.id)
+            
+            if batch_job.status != "completed":
+                print(f"❌ Batch未完成, 状态: {batch_job.status}")
+                return
+            
+            # 下载结果
+            for file_id in (batch_job.output_file_id, batch_job.error_file_id):
+                if file_id:
+                    result_file = await client.files.content(file_id)
+                    result_lines.extend(result_file.text.splitlines())
+        
+    success_count = 0
+    error_count = skipped_count
+    
+    # 保存缓存命中的响应和batch结果，输出文件只打开一次
+    with open(OUTPUT_FILE, "ab", buffering=1 << 16) as out_f:
+        # 恢复轮询时只保存batch结果，本次传入范围内的缓存不属于该batch
+        for data_id, image_url, response in (cached if batch_id is None else []):
+            if save_response(response, data_id, image_url, out_f):
+                success_count += 1
+            else:
+                error_count += 1
+        
+        for line in result_lines:
+            result = orjson.loads(line)
+            custom_id = result['custom_id']
+            resolved = resolve_custom_id(custom_id, groups)
+            if resolved is None:
+                print(f"   ❌ 无法识别的custom_id: {custom_id}")
+                with open("chemistry_error_log.txt", "a", encoding="utf-8") as f:
+                    f.write(f"ID: {custom_id}\nError: 无法识别的custom_id，结果未保存\n{'='*50}\n")
+                error_count += 1
+                continue
+            data_ids, image_url, cache_key = resolved
+            result_response = result.get('response') or {}
+            
+            failed = bool(result.get('error')) or result_response.get('status_code') != 200
+            if failed:
+                error = result.get('error') or result_response.get('body', {}).get('error')
+            else:
+                # 模型拒绝回答等情况下content为null，只记为该项失败
+                message = result_response['body']['choices'][0]['message']
+                if not message.get('content'):
+                    failed = True
+                    error = message.get('refusal') or "响应内容为空"
+            
+            if failed:
+                print(f"   ❌ ID {', '.join(data_ids)}: 请求失败: {error}")
+                with open("chemistry_error_log.txt", "a", encoding="utf-8") as f:
+                    for data_id in data_ids:
+                        f.write(f"ID: {data_id}\nError: {error}\n{'='*50}\n")
+                error_count += len(data_ids)
+                continue
+            
+            response = message['content'].strip()
+            for success in save_response_for_ids(response, data_ids, image_url, out_f, cache_key):
+                if success:
+                    success_count += 1
+                else:
+                    error_count += 1
+    
+    # 输出统计信息
+    print(f"\n{'='*50}")
+    print(f"📊 处理完成!")
+    print(f"✅ 成功: {success_count} 个")
+    print(f"❌ 失败: {error_count} 个")
+    print(f"📁 输出文件: {OUTPUT_FILE}")
     if error_count > 0:
         print(f"📝 错误日志: chemistry_error_log.txt")
     print(f"{'='*50}")
@@ -302,43 +1033,42 @@ def generate_demo_data():
     
     print(f"🎯 生成前5个样本的演示数据...")
     
-    for i, data_item in enumerate(demo_data):
-        # 提取数据
-        image_path = data_item['image_path']
-        image_filename = os.path.basename(image_path)
-        image_url = generate_github_url(image_filename)
-        text_description = data_item['text']
-        
-        # 创建演示QA对
-        qa_pair = {
-            "domain": "natural_science",
-            "subdomain": "chemistry",
-            "id": str(i + 1),
-            "input": {
-                "modal": {
-                    "image1": image_url
-                },
-                "content": f"Please examine the chemical diagram shown in <image1> and provide a comprehensive audio explanation of the scientific concepts, molecular structures, and chemical processes illustrated in this chemistry-related image."
-            },
-            "output": {
-                "modal": {
-                    "audio1": text_description
+    with open(output_file, "ab") as f:
+        for i, data_item in enumerate(demo_data):
+            # 提取数据
+            image_path = data_item['image_path']
+            image_filename = os.path.basename(image_path)
+            image_url = generate_github_url(image_filename)
+            text_description = data_item['text']
+            
+            # 创建演示QA对
+            qa_pair = {
+                "domain": "natural_science",
+                "subdomain": "chemistry",
+                "id": str(i + 1),
+                "input": {
+                    "modal": {
+                        "image1": image_url
+                    },
+                    "content": f"Please examine the chemical diagram shown in <image1> and provide a comprehensive audio explanation of the scientific concepts, molecular structures, and chemical processes illustrated in this chemistry-related image."
                 },
-                "content": f"Based on my analysis of the chemical diagram, here is the detailed audio explanation: <audio1>"
+                "output": {
+                    "modal": {
+                        "audio1": text_description
+                    },
+                    "content": f"Based on my analysis of the chemical diagram, here is the detailed audio explanation: <audio1>"
+                }
             }
-        }
-        
-        # 保存到文件（格式化的多行JSON）
-        with open(output_file, "a", encoding="utf-8") as f:
-            formatted_json = json.dumps(qa_pair, ensure_ascii=False, indent=2)
-            f.write(formatted_json + "\n")
-        
-        print(f"   ✅ 生成样本 {i + 1}/5: {image_filename}")
+            
+            # 保存到文件（每条记录一行）
+            f.write(orjson.dumps(qa_pair) + b"\n")
+            
+            print(f"   ✅ 生成样本 {i + 1}/5: {image_filename}")
     
     print(f"💾 演示数据已保存到: {output_file}")
     print(f"{'='*50}")
 
-def validate_generated_data(filename: str = "chemistry_qa_pairs.jsonl"):
+def validate_generated_data(filename: str = OUTPUT_FILE):
     """验证生成的数据格式"""
     if not os.path.exists(filename):
         print(f"❌ 文件不存在: {filename}")
@@ -348,34 +1078,37 @@ def validate_generated_data(filename: str = "chemistry_qa_pairs.jsonl"):
     print("=" * 50)
     
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
         valid_count = 0
         error_count = 0
+        total_count = 0
         
-        for i, line in enumerate(lines):
-            try:
-                data = json.loads(line.strip())
+        # 逐行流式读取，内存占用与文件大小无关
+        with open(filename, 'rb') as f:
+            for i, line in enumerate(f, 1):
+                total_count += 1
+                try:
+                    data = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    print(f"   ❌ 第{i}行JSON格式错误")
+                    error_count += 1
+                    continue
                 
                 # 检查必要字段
-                required_fields = ['domain', 'subdomain', 'id', 'input', 'output']
-                missing_fields = [field for field in required_fields if field not in data]
-                
-                if missing_fields:
-                    print(f"   ❌ 第{i+1}行缺少字段: {missing_fields}")
+                if not all(field in data for field in REQUIRED_FIELDS):
+                    missing_fields = [field for field in REQUIRED_FIELDS if field not in data]
+                    print(f"   ❌ 第{i}行缺少字段: {missing_fields}")
                     error_count += 1
                     continue
                 
                 # 检查input结构
                 if 'modal' not in data['input'] or 'image1' not in data['input']['modal']:
-                    print(f"   ❌ 第{i+1}行input缺少image1")
+                    print(f"   ❌ 第{i}行input缺少image1")
                     error_count += 1
                     continue
                 
                 # 检查output结构
                 if 'modal' not in data['output'] or 'audio1' not in data['output']['modal']:
-                    print(f"   ❌ 第{i+1}行output缺少audio1")
+                    print(f"   ❌ 第{i}行output缺少audio1")
                     error_count += 1
                     continue
                 
@@ -384,31 +1117,41 @@ def validate_generated_data(filename: str = "chemistry_qa_pairs.jsonl"):
                 output_content = data['output'].get('content', '')
                 
                 if '<image1>' not in input_content:
-                    print(f"   ❌ 第{i+1}行input content缺少<image1>标签")
+                    print(f"   ❌ 第{i}行input content缺少<image1>标签")
                     error_count += 1
                     continue
                 
                 if '<audio1>' not in output_content:
-                    print(f"   ❌ 第{i+1}行output content缺少<audio1>标签")
+                    print(f"   ❌ 第{i}行output content缺少<audio1>标签")
                     error_count += 1
                     continue
                 
                 valid_count += 1
-                
-            except json.JSONDecodeError:
-                print(f"   ❌ 第{i+1}行JSON格式错误")
-                error_count += 1
         
         print(f"✅ 有效记录: {valid_count}")
         print(f"❌ 错误记录: {error_count}")
-        print(f"📊 总记录数: {len(lines)}")
+        print(f"📊 总记录数: {total_count}")
         print(f"{'='*50}")
         
     except Exception as e:
         print(f"❌ 验证过程出错: {e}")
 
-def main():
-    """主函数"""
+def view_generated_data(filename: str = OUTPUT_FILE, limit: int = 5):
+    """格式化显示生成的数据，便于人工查看（文件本身保持每行一条记录）"""
+    if not os.path.exists(filename):
+        print(f"❌ 文件不存在: {filename}")
+        return
+    
+    with open(filename, 'rb') as f:
+        for i, line in enumerate(itertools.islice(f, limit), 1):
+            print(f"----- 第{i}行 -----")
+            try:
+                print(orjson.dumps(orjson.loads(line), option=orjson.OPT_INDENT_2).decode())
+            except orjson.JSONDecodeError:
+                print(f"❌ JSON格式错误: {line.decode('utf-8', errors='replace').rstrip()}")
+
+def interactive_menu():
+    """交互式菜单"""
     print("🧪 化学QA对批量生成脚本")
     print("=" * 50)
     print("📥 输入模式: 1张化学图片 + 文本描述")
@@ -419,8 +1162,11 @@ def main():
     print("2. 批量处理 (使用GPT-4o)")
     print("3. 生成演示数据 (无需API)")
     print("4. 验证生成的数据")
+    print("5. 离线批量处理 (OpenAI Batch API, 费用减半)")
+    print("6. 查看生成的数据 (格式化显示)")
+    print("7. 预先缩小本地图片 (以base64内联发送)")
     
-    choice = input("请输入选择 (1-4): ").strip()
+    choice = input("请输入选择 (1-7): ").strip()
     
     if choice == "1":
         # 单次处理模式
@@ -436,7 +1182,7 @@ def main():
         index = int(index) if index.isdigit() else 0
         
         if 0 <= index < len(original_data):
-            process_single_item(original_data[index], str(index + 1))
+            asyncio.run(process_single_item(original_data[index], str(index + 1)))
         else:
             print("❌ 索引超出范围")
         
@@ -445,14 +1191,18 @@ def main():
         print("\n📊 批量处理模式")
         start_index = input("请输入起始索引 (默认: 0): ").strip()
         end_index = input("请输入结束索引 (默认: 9): ").strip()
-        delay = input("请输入API延迟秒数 (默认: 2): ").strip()
+        concurrency = input("请输入最大并发数 (默认: 16): ").strip()
+        rpm = input("请输入每分钟最大请求数 (默认: 500): ").strip()
+        group_size = input("请输入每次请求合并的数据项数 (默认: 1): ").strip()
         
         # 设置默认值
         start_index = int(start_index) if start_index.isdigit() else 0
         end_index = int(end_index) if end_index.isdigit() else 9
-        delay = int(delay) if delay.isdigit() else 2
+        concurrency = int(concurrency) if concurrency.isdigit() and int(concurrency) > 0 else 16
+        rpm = int(rpm) if rpm.isdigit() and int(rpm) > 0 else 500
+        group_size = int(group_size) if group_size.isdigit() and int(group_size) > 0 else 1
         
-        batch_process(start_index, end_index, delay)
+        asyncio.run(batch_process(start_index, end_index, concurrency, rpm, group_size))
         
     elif choice == "3":
         # 生成演示数据
@@ -460,13 +1210,104 @@ def main():
         
     elif choice == "4":
         # 验证数据
-        filename = input("请输入要验证的文件名 (默认: chemistry_qa_pairs.jsonl): ").strip()
+        filename = input(f"请输入要验证的文件名 (默认: {OUTPUT_FILE}): ").strip()
         if not filename:
-            filename = "chemistry_qa_pairs.jsonl"
+            filename = OUTPUT_FILE
         validate_generated_data(filename)
         
+    elif choice == "5":
+        # 离线批量处理模式
+        print("\n📦 离线批量处理模式")
+        batch_id = input("请输入已提交的batch ID (留空则新建): ").strip()
+        start_index = input("请输入起始索引 (默认: 0): ").strip()
+        end_index = input("请输入结束索引 (默认: 9): ").strip()
+        
+        # 设置默认值
+        start_index = int(start_index) if start_index.isdigit() else 0
+        end_index = int(end_index) if end_index.isdigit() else 9
+        
+        asyncio.run(batch_process_offline(start_index, end_index, batch_id or None))
+        
+    elif choice == "6":
+        # 格式化查看数据
+        filename = input(f"请输入要查看的文件名 (默认: {OUTPUT_FILE}): ").strip()
+        if not filename:
+            filename = OUTPUT_FILE
+        limit = input("请输入显示的记录数 (默认: 5): ").strip()
+        limit = int(limit) if limit.isdigit() else 5
+        view_generated_data(filename, limit)
+        
+    elif choice == "7":
+        # 预先缩小图片
+        resize_images()
+        
     else:
         print("❌ 无效选择")
 
+def positive_int(value: str) -> int:
+    """argparse类型：正整数（并发数、RPM等为0或负数时会导致挂起或限流器报错）"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"需要正整数，得到: {value}")
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"需要正整数，得到: {value}")
+    return number
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="批量生成化学QA对（文+图 -> 文+音）")
+    parser.add_argument("--mode", choices=["single", "batch", "offline", "demo", "validate", "pretty", "resize"],
+                        help="运行模式；不指定时进入交互式菜单")
+    parser.add_argument("--interactive", action="store_true", help="进入交互式菜单")
+    parser.add_argument("--index", type=int, default=0, help="single模式要处理的索引 (默认: 0)")
+    parser.add_argument("--start", type=int, default=0, help="起始索引 (默认: 0)")
+    parser.add_argument("--end", type=int, default=9, help="结束索引 (默认: 9)")
+    parser.add_argument("--concurrency", type=positive_int, default=16, help="最大并发请求数 (默认: 16)")
+    parser.add_argument("--rpm", type=positive_int, default=500, help="每分钟最大请求数 (默认: 500)")
+    parser.add_argument("--group-size", type=positive_int, default=1, help="batch模式下每次请求合并的数据项数 (默认: 1)")
+    parser.add_argument("--batch-id", help="offline模式下继续轮询已提交的batch")
+    parser.add_argument("--skip-preflight", action="store_true", help="调用API前不检查图片URL是否可访问")
+    parser.add_argument("--file", default=OUTPUT_FILE, help=f"validate/pretty模式使用的文件 (默认: {OUTPUT_FILE})")
+    parser.add_argument("--limit", type=positive_int, default=5, help="pretty模式显示的记录数 (默认: 5)")
+    return parser.parse_args()
+
+def main():
+    """主函数"""
+    args = parse_args()
+    
+    if args.interactive or args.mode is None:
+        interactive_menu()
+    
+    elif args.mode == "single":
+        original_data = load_original_data()
+        if not original_data:
+            print("❌ 无法加载原始数据")
+            return
+        
+        if 0 <= args.index < len(original_data):
+            asyncio.run(process_single_item(original_data[args.index], str(args.index + 1)))
+        else:
+            print("❌ 索引超出范围")
+    
+    elif args.mode == "batch":
+        asyncio.run(batch_process(args.start, args.end, args.concurrency, args.rpm, args.group_size,
+                                  preflight=not args.skip_preflight))
+    
+    elif args.mode == "offline":
+        asyncio.run(batch_process_offline(args.start, args.end, args.batch_id, preflight=not args.skip_preflight))
+    
+    elif args.mode == "demo":
+        generate_demo_data()
+    
+    elif args.mode == "validate":
+        validate_generated_data(args.file)
+    
+    elif args.mode == "pretty":
+        view_generated_data(args.file, args.limit)
+    
+    elif args.mode == "resize":
+        resize_images()
+
 if __name__ == "__main__":
     main()
@@ -5,14 +5,30 @@
 文+图 -> 文+图 (多图输入，多图输出)
 """
 
+import argparse
+import asyncio
+import atexit
+import base64
+import bisect
+import functools
+import hashlib
+import io
 import json
+import mmap
 import os
+import pickle
+import sqlite3
 import time
 import random
 from pathlib import Path
 from collections import defaultdict
+import fastjsonschema
+import httpx
+import orjson
+from aiolimiter import AsyncLimiter
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import APIError, APIStatusError, AsyncOpenAI
+from PIL import Image
 
 # 加载环境变量
 load_dotenv('config.env')
@@ -20,72 +36,36 @@ load_dotenv('config.env')
 # 从环境变量获取API密钥
 API_KEY = os.getenv('OPENAI_API_KEY')
 
-class MultiImageQAGeneratorV2:
-    def __init__(self, mapping_file="images_301_900.jsonl"):
-        self.mapping_file = mapping_file
-        self.github_base_url = "https://raw.githubusercontent.com/Shize-ZHANG/Any2Any-chemistry/main/original_data"
-        self.client = OpenAI(api_key=API_KEY)
-        
-    def load_image_mapping(self):
-        """加载图片映射文件，按ID分组"""
-        try:
-            image_groups = defaultdict(list)
-            
-            with open(self.mapping_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = json.loads(line.strip())
-                    query_id = data['id']
-                    image_path = data['image_path']
-                    # 提取文件名 (去掉images/前缀)
-                    image_filename = os.path.basename(image_path)
-                    image_groups[query_id].append(image_filename)
-            
-            # 转换为普通字典并排序图片
-            result = {}
-            for query_id, images in image_groups.items():
-                result[query_id] = sorted(images)
-            
-            return result
-            
-        except FileNotFoundError:
-            print(f"❌ 找不到映射文件: {self.mapping_file}")
-            return {}
-        except Exception as e:
-            print(f"❌ 加载映射文件失败: {e}")
-            return {}
-    
-    def generate_github_url(self, image_filename: str) -> str:
-        """根据图片文件名生成GitHub URL"""
-        return f"{self.github_base_url}/images/{image_filename}"
-    
-    def split_images_for_qa(self, images: list) -> tuple:
-        """
-        将图片列表分成两部分用于输入和输出
-        确保两部分都至少有一张图片，且保持原始顺序
-        """
-        total_images = len(images)
-        if total_images < 2:
-            raise ValueError(f"至少需要2张图片才能分割，当前只有{total_images}张")
-        
-        # 随机选择分割点（确保两部分都有至少1张图片）
-        split_point = random.randint(1, total_images - 1)
-        
-        input_images = images[:split_point]
-        output_images = images[split_point:]
-        
-        return input_images, output_images
-    
-    def create_prompt(self, input_images: list, output_images: list, data_id: str) -> str:
-        """创建用于生成多图QA对的prompt"""
-        
-        # 构建原始数据部分
-        original_data = "{\n"
-        for i, img in enumerate(input_images + output_images, 1):
-            url = self.generate_github_url(img)
-            original_data += f'    "image{i}": "{url}",\n'
-        original_data = original_data.rstrip(',\n') + "\n}"
-        
-        prompt = f"""You are a multimodal expert. Based on the following original data, please construct a data (Question-Answer pair) entry that strictly conforms to the JSON format below.
+# 使用的模型和系统prompt
+MODEL = "gpt-4o"
+SYSTEM_PROMPT = "You are a multimodal expert specialized in chemistry education. Generate structured JSON data for chemistry-related multimodal question-answer pairs with multiple images. Always respond with properly formatted JSON."
+
+# 默认最大并发请求数
+DEFAULT_CONCURRENCY = 10
+
+# 账户的每分钟请求数(RPM)和每分钟token数(TPM)上限，按实际账户等级调整
+DEFAULT_RPM = 500
+DEFAULT_TPM = 300000
+
+# 遇到限流(429)、超时、连接错误和5xx时的最大重试次数（指数退避+随机抖动，遵循Retry-After）
+MAX_RETRIES = 5
+
+# 流式接收中途断开时由本脚本重新发送整个请求，退避时间从该值开始翻倍，不超过上限（秒）
+STREAM_RETRY_BASE_DELAY = 1
+STREAM_RETRY_MAX_DELAY = 30
+
+# 单个QA对的最大输出token数；合并请求按查询数放大，但不超过模型的输出上限
+MAX_TOKENS = 3000
+MAX_OUTPUT_TOKENS = 16384
+
+# 合并请求时单条消息最多携带的输入图片数
+MAX_IMAGES_PER_REQUEST = 20
+
+# Batch API请求文件
+BATCH_REQUESTS_FILE = "multiimage_batch_requests.jsonl"
+
+# 生成多图QA对的prompt模板，固定部分只定义一次，每个查询只填充图片URL、数量和标签
+PROMPT_TEMPLATE = """You are a multimodal expert. Based on the following original data, please construct a data (Question-Answer pair) entry that strictly conforms to the JSON format below.
 Please design a multimodal interleaved Question-Answer pair. You can place different pieces of information from the original data into the input or output of the Question-Answer pair.
 
 [Original data]
@@ -124,82 +104,526 @@ This Question-Answer pair must adhere to the following structure in the followin
 8 You need to divide the images in the original data into two parts, making sure not to change their original order. Both parts must contain at least one image. Place the first part in the input and the second part in the output.
 9 CRITICAL: The question-answer pair MUST be chemically and scientifically relevant. The input question should logically connect to the output answer through chemical concepts, molecular structures, reactions, or properties shown in the images. Avoid generic or unrelated questions.
 
-Input images (first {len(input_images)} images): {[self.generate_github_url(img) for img in input_images]}
-Output images (remaining {len(output_images)} images): {[self.generate_github_url(img) for img in output_images]}
+Input images (first {input_count} images): {input_urls}
+Output images (remaining {output_count} images): {output_urls}
 
 [Tag Usage Rules]
-- Input content can ONLY use tags for input images: {', '.join([f'<image{i+1}>' for i in range(len(input_images))])}
-- Output content can ONLY use tags for output images: {', '.join([f'<image{i+len(input_images)+1}>' for i in range(len(output_images))])}
+- Input content can ONLY use tags for input images: {input_tags}
+- Output content can ONLY use tags for output images: {output_tags}
 - Cross-referencing between input and output images is strictly forbidden
 """
-        return prompt
+
+# 生成的QA对必须满足的结构（图片数量取决于每次的分割，单独检查）
+QA_SCHEMA = {
+    "type": "object",
+    "required": ["domain", "subdomain", "id", "input", "output"],
+    "properties": {
+        "input": {"$ref": "#/definitions/part"},
+        "output": {"$ref": "#/definitions/part"}
+    },
+    "definitions": {
+        "part": {
+            "type": "object",
+            "required": ["modal", "content"],
+            "properties": {
+                "modal": {"type": "object"}
+            }
+        }
+    }
+}
+
+# 预先编译为Python函数，每次验证直接调用
+_validate_qa_schema = fastjsonschema.compile(QA_SCHEMA)
+
+# 合并多个查询到一次请求时只在最前面给出一次的固定规则（JSON模板和构造要求直接取自PROMPT_TEMPLATE，两者保持一致）
+GROUP_INSTRUCTIONS = """You are a multimodal expert. This message contains several independent queries. For every query, please construct a data (Question-Answer pair) entry that strictly conforms to the JSON format below, based on that query's original data.
+Please design multimodal interleaved Question-Answer pairs. You can place different pieces of information from a query's original data into the input or output of its Question-Answer pair.
+
+""" + PROMPT_TEMPLATE[
+    PROMPT_TEMPLATE.index("[Question-Answer pair JSON template]"):PROMPT_TEMPLATE.index("Input images (first")
+].format(data_id="<id of the query>") + """[Queries]
+Each query starts with a line "### Query <n>" followed by a line "QA #<n> for id=<id>, images=[...]" listing all of its images in order, then which images go to the input and which to the output, and finally its own input images.
+Image numbering restarts at <image1> within each query. Input content can ONLY use the query's input tags, output content can ONLY use the query's output tags, and cross-referencing between input and output images is strictly forbidden.
+
+[Response format]
+Respond with a single JSON object of the form {"qa_pairs": [<pair for query 1>, <pair for query 2>, ...]} containing exactly one entry per query, in the same order, with each entry's "id" set to its query's id.
+"""
+
+# 解析后图片映射的磁盘缓存目录
+MAPPING_CACHE_DIR = ".cache"
+
+# 发送给模型前将图片缩小到最长边不超过该值，并转为JPEG以base64内联
+ENCODED_IMAGE_MAX_SIDE = 1024
+ENCODED_IMAGE_QUALITY = 85
+
+# 预取图片时的最大并发下载数
+PREFETCH_CONCURRENCY = 32
+
+# 下载图片共用的HTTP客户端，保持到GitHub的连接复用（线程安全）
+_image_http_client = httpx.Client(
+    timeout=30,
+    follow_redirects=True,
+    limits=httpx.Limits(max_keepalive_connections=PREFETCH_CONCURRENCY, max_connections=PREFETCH_CONCURRENCY)
+)
+
+# 本地响应缓存：相同的prompt和输入图片重复请求时直接复用之前通过验证的响应
+CACHE_FILE = ".multiimage_qa_cache.sqlite3"
+CACHE_EXPIRE_SECONDS = 30 * 86400
+
+@functools.lru_cache(maxsize=None)
+def _load_image_mapping(mapping_file: str, mtime: float, size: int) -> dict:
+    """
+    解析图片映射文件，按ID分组
     
-    def call_openai_api(self, prompt: str, input_images: list) -> str:
-        """调用OpenAI API生成QA对"""
-        try:
-            # 构建消息内容，包含文本和多张图片
-            content = [{"type": "text", "text": prompt}]
+    结果按(路径, 修改时间, 大小)缓存：同一进程内只解析一次，跨进程复用磁盘上的pickle，文件变化后自动失效
+    """
+    cache_key = hashlib.sha256(f"{mapping_file}|{mtime}|{size}".encode()).hexdigest()
+    cache_path = os.path.join(MAPPING_CACHE_DIR, f"{cache_key}.pkl")
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except (pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        # 缓存文件损坏（如写入中途被中断），视为未命中并重新解析
+        print(f"⚠️ 映射缓存已损坏，重新解析: {cache_path}")
+    
+    image_groups = defaultdict(list)
+    
+    # 内存映射整个文件，按行切片后直接交给orjson解析（orjson可忽略行尾换行符）；空文件无法映射
+    with open(mapping_file, 'rb') as f, \
+            (mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else io.BytesIO()) as mm:
+        for line in iter(mm.readline, b''):
+            data = orjson.loads(line)
+            query_id = data['id']
+            image_path = data['image_path']
+            # 提取文件名 (去掉images/前缀)
+            image_filename = os.path.basename(image_path)
+            # 读取时保持每组图片有序：映射文件通常已排序，直接追加即可，否则二分插入
+            group = image_groups[query_id]
+            if not group or image_filename >= group[-1]:
+                group.append(image_filename)
+            else:
+                bisect.insort(group, image_filename)
+    
+    # 转换为普通字典
+    result = dict(image_groups)
+    
+    # 先写临时文件再原子替换，避免中断或多进程并发写入留下不完整的缓存
+    os.makedirs(MAPPING_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"⚠️ 写入映射缓存失败: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    
+    return result
+
+@functools.lru_cache(maxsize=4096)
+def _encode_image(url: str) -> str:
+    """
+    下载图片，缩小并转为JPEG后编码为data URL
+    
+    图片内联在请求中，OpenAI无需再从GitHub拉取原图；同一张图片在进程内只下载和编码一次
+    """
+    response = _image_http_client.get(url)
+    response.raise_for_status()
+    
+    with Image.open(io.BytesIO(response.content)) as img:
+        # 先转为RGB再缩小：调色板(P)和二值(1)图片PIL只能用最近邻缩放，细线和文字会锯齿或丢失
+        # JPEG不支持透明通道，透明部分铺白底
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        img.thumbnail((ENCODED_IMAGE_MAX_SIDE, ENCODED_IMAGE_MAX_SIDE))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=ENCODED_IMAGE_QUALITY, optimize=True)
+    
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode('ascii')
+
+def split_group_response(response: str, query_ids: list) -> list:
+    """
+    将合并请求的响应按查询ID拆分为每个查询各自的响应
+    
+    Args:
+        response: API返回的响应，调用失败时为None
+        query_ids: 请求中各查询的ID
+        
+    Returns:
+        与query_ids顺序对应的响应列表，缺失或无法解析的项为None
+    """
+    try:
+        qa_pairs = orjson.loads(response).get('qa_pairs') if response else None
+    except (orjson.JSONDecodeError, AttributeError):
+        qa_pairs = None
+    if not isinstance(qa_pairs, list):
+        return [None] * len(query_ids)
+    
+    by_id = {str(qa_pair.get('id')): qa_pair for qa_pair in qa_pairs if isinstance(qa_pair, dict)}
+    return [
+        orjson.dumps(by_id[query_id]).decode() if query_id in by_id else None
+        for query_id in query_ids
+    ]
+
+def pack_query_groups(query_ids: list, input_counts: dict, group_size: int) -> list:
+    """
+    按顺序把查询打包成组，每组最多group_size个查询，且输入图片总数不超过MAX_IMAGES_PER_REQUEST
+    
+    Args:
+        query_ids: 查询ID列表
+        input_counts: {query_id: 输入图片数}
+        group_size: 每组最多的查询数
+        
+    Returns:
+        查询ID分组列表；单个查询图片数超过上限时单独成组
+    """
+    groups = []
+    current = []
+    current_images = 0
+    for query_id in query_ids:
+        count = input_counts[query_id]
+        if current and (len(current) >= group_size or current_images + count > MAX_IMAGES_PER_REQUEST):
+            groups.append(current)
+            current = []
+            current_images = 0
+        current.append(query_id)
+        current_images += count
+    if current:
+        groups.append(current)
+    return groups
+
+class JSONObjectTracker:
+    """逐块跟踪流式输出中最外层JSON对象的括号深度（忽略字符串内的括号），用于在对象闭合时提前结束接收"""
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+    
+    def feed(self, text: str) -> int:
+        """
+        处理一段新输出
+        
+        Args:
+            text: 新收到的文本
             
-            # 添加输入图片到API调用中
-            for img in input_images:
-                img_url = self.generate_github_url(img)
-                content.append({
-                    "type": "image_url", 
-                    "image_url": {"url": img_url}
-                })
+        Returns:
+            对象在这段文本中闭合时返回闭合括号之后的位置，否则返回-1
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a multimodal expert specialized in chemistry education. Generate structured JSON data for chemistry-related multimodal question-answer pairs with multiple images. Always respond with properly formatted JSON."
-                    },
-                    {
-                        "role": "user",
-                        "content": content
-                    }
-                ],
-                max_tokens=3000,
-                response_format={"type": "json_object"}
-            )
+        Raises:
+            ValueError: 对象开始之前出现了非空白字符
+        """
+        for pos, char in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '{':
+                self.depth += 1
+                self.started = True
+            elif not self.started:
+                if not char.isspace():
+                    raise ValueError(f"响应不是JSON对象: {text[:50]!r}")
+            elif char == '"':
+                self.in_string = True
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    return pos + 1
+        return -1
+
+class MultiImageQAGeneratorV2:
+    def __init__(self, mapping_file="images_301_900.jsonl", rpm=DEFAULT_RPM, tpm=DEFAULT_TPM):
+        self.mapping_file = mapping_file
+        self.github_base_url = "https://raw.githubusercontent.com/Shize-ZHANG/Any2Any-chemistry/main/original_data"
+        # 可重试的错误由客户端自动退避重试，其余4xx错误重试也不会成功，直接失败
+        self.client = AsyncOpenAI(api_key=API_KEY, max_retries=MAX_RETRIES)
+        # 令牌桶限流：请求发出前同时占用RPM和TPM额度，额度不足时等待而不是等到429
+        self.rpm_limiter = AsyncLimiter(rpm, 60)
+        self.tpm_limiter = AsyncLimiter(tpm, 60)
+        # 图片文件名 -> GitHub URL，加载映射时一次性生成
+        self.url_by_name = {}
+        self.cache_conn = None
+        # 输出文件句柄，整个运行期间复用，退出时关闭
+        self.output_files = {}
+        # 运行中由写入协程消费的保存队列，未启动时直接同步保存
+        self.save_queue = None
+        self.writer_task = None
+        atexit.register(self.close_output_files)
+        
+    def load_image_mapping(self):
+        """加载图片映射文件，按ID分组（带缓存），同时生成所有图片的GitHub URL"""
+        try:
+            stat = os.stat(self.mapping_file)
+            image_mapping = _load_image_mapping(os.path.abspath(self.mapping_file), stat.st_mtime, stat.st_size)
+            self.url_by_name = {
+                name: self.generate_github_url(name)
+                for names in image_mapping.values()
+                for name in names
+            }
+            return image_mapping
             
-            return response.choices[0].message.content.strip()
+        except FileNotFoundError:
+            print(f"❌ 找不到映射文件: {self.mapping_file}")
+            return {}
+        except Exception as e:
+            print(f"❌ 加载映射文件失败: {e}")
+            return {}
+    
+    def generate_github_url(self, image_filename: str) -> str:
+        """根据图片文件名生成GitHub URL"""
+        return f"{self.github_base_url}/images/{image_filename}"
+    
+    def get_response_cache(self) -> sqlite3.Connection:
+        """获取本地响应缓存的数据库连接（首次调用时创建）"""
+        if self.cache_conn is None:
+            # 缓存由写入线程写入，连接需允许跨线程使用（sqlite以串行模式编译，共享连接是安全的）
+            self.cache_conn = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+            self.cache_conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+        return self.cache_conn
+    
+    def make_cache_key(self, prompt: str, input_images: list) -> str:
+        """根据模型、系统prompt、用户prompt和输入图片计算缓存键"""
+        raw = f"{MODEL}|{SYSTEM_PROMPT}|{prompt}|{'|'.join(input_images)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def load_cached_response(self, key: str) -> str:
+        """读取未过期的缓存响应，不存在时返回None"""
+        row = self.get_response_cache().execute(
+            "SELECT response FROM responses WHERE key = ? AND created_at > ?",
+            (key, time.time() - CACHE_EXPIRE_SECONDS)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def save_cached_response(self, key: str, response: str):
+        """保存通过验证的API响应到本地缓存"""
+        conn = self.get_response_cache()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created_at) VALUES (?, ?, ?)",
+                (key, response, time.time())
+            )
+    
+    def split_images_for_qa(self, images: list, query_id: str = None) -> tuple:
+        """
+        将图片列表分成两部分用于输入和输出
+        确保两部分都至少有一张图片，且保持原始顺序
+        传入query_id时以其为随机种子，同一查询每次得到相同的分割，重跑时可以命中响应缓存
+        """
+        total_images = len(images)
+        if total_images < 2:
+            raise ValueError(f"至少需要2张图片才能分割，当前只有{total_images}张")
+        
+        # 随机选择分割点（确保两部分都有至少1张图片）
+        rng = random.Random(query_id) if query_id is not None else random
+        split_point = rng.randint(1, total_images - 1)
+        
+        input_images = images[:split_point]
+        output_images = images[split_point:]
+        
+        return input_images, output_images
+    
+    def create_prompt(self, input_images: list, output_images: list, data_id: str) -> str:
+        """创建用于生成多图QA对的prompt"""
+        
+        # 构建原始数据部分（保持4空格缩进，orjson只支持2空格，改用会改变prompt和缓存键）
+        original_data = json.dumps(
+            {f"image{i}": self.url_by_name[img] for i, img in enumerate(input_images + output_images, 1)},
+            indent=4,
+            ensure_ascii=False
+        )
+        
+        input_count = len(input_images)
+        return PROMPT_TEMPLATE.format(
+            original_data=original_data,
+            data_id=data_id,
+            input_count=input_count,
+            output_count=len(output_images),
+            input_urls=[self.url_by_name[img] for img in input_images],
+            output_urls=[self.url_by_name[img] for img in output_images],
+            input_tags=', '.join(f'<image{i}>' for i in range(1, input_count + 1)),
+            output_tags=', '.join(f'<image{i}>' for i in range(input_count + 1, input_count + len(output_images) + 1))
+        )
+    
+    def create_group_query(self, n: int, query_id: str, input_images: list, output_images: list) -> str:
+        """创建合并请求中单个查询的部分，只包含该查询的ID、图片URL、数量和标签，固定规则见GROUP_INSTRUCTIONS"""
+        input_urls = [self.url_by_name[img] for img in input_images]
+        output_urls = [self.url_by_name[img] for img in output_images]
+        input_count = len(input_images)
+        input_tags = ', '.join(f'<image{i}>' for i in range(1, input_count + 1))
+        output_tags = ', '.join(f'<image{i}>' for i in range(input_count + 1, input_count + len(output_images) + 1))
+        
+        return (
+            f"### Query {n}\n"
+            f"QA #{n} for id={query_id}, images={input_urls + output_urls}\n"
+            f"- Input images (first {input_count} images): {input_urls}; input tags: {input_tags}\n"
+            f"- Output images (remaining {len(output_images)} images): {output_urls}; output tags: {output_tags}"
+        )
+    
+    def estimate_tokens(self, prompt: str, max_tokens: int = MAX_TOKENS) -> int:
+        """粗略估算一次请求占用的token数（prompt按4字符/token，加上最大输出token数）"""
+        return len(prompt) // 4 + max_tokens
+    
+    def build_image_contents(self, input_images: list) -> list:
+        """构建消息中的图片部分，优先以base64内联，下载失败时退回GitHub URL"""
+        contents = []
+        for img in input_images:
+            img_url = self.url_by_name[img]
+            try:
+                img_url = _encode_image(img_url)
+            except Exception as e:
+                print(f"   ⚠️  图片编码失败，改用URL: {img} ({e})")
+            contents.append({
+                "type": "image_url", 
+                "image_url": {"url": img_url}
+            })
+        return contents
+    
+    def build_request_body(self, prompt: str, input_images: list) -> dict:
+        """构建chat completions请求体，实时调用和Batch API共用"""
+        # 构建消息内容，包含文本和多张图片
+        content = [{"type": "text", "text": prompt}]
+        content.extend(self.build_image_contents(input_images))
+        
+        return self.build_chat_body(content)
+    
+    def build_group_request_body(self, items: list) -> dict:
+        """
+        构建合并多个查询的请求体，固定规则只出现一次，之后每个查询只带自己的图片信息和输入图片
+        
+        Args:
+            items: (query_id, query_text, input_images) 列表，query_text由create_group_query生成
+        """
+        content = [{"type": "text", "text": GROUP_INSTRUCTIONS}]
+        for _, query_text, input_images in items:
+            content.append({"type": "text", "text": query_text})
+            content.extend(self.build_image_contents(input_images))
+        
+        return self.build_chat_body(content, min(MAX_TOKENS * len(items), MAX_OUTPUT_TOKENS))
+    
+    def build_chat_body(self, content: list, max_tokens: int = MAX_TOKENS) -> dict:
+        """构建带固定系统prompt的chat completions请求体"""
+        return {
+            "model": MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"}
+        }
+    
+    async def call_openai_api(self, prompt: str, input_images: list) -> str:
+        """调用OpenAI API生成QA对"""
+        return await self.request_completion(
+            functools.partial(self.build_request_body, prompt, input_images),
+            self.estimate_tokens(prompt)
+        )
+    
+    async def request_completion(self, build_body, estimated_tokens: int) -> str:
+        """
+        限流后发送请求并流式接收响应
+        
+        建立请求时的错误已由客户端按MAX_RETRIES重试；接收过程中连接断开、超时或收到error事件时，
+        重新发送整个请求，同样最多重试MAX_RETRIES次
+        
+        Args:
+            build_body: 返回请求体的函数（需要下载和编码图片，在线程中执行）
+            estimated_tokens: 本次请求预计占用的token数
             
+        Returns:
+            响应文本，失败时返回None
+        """
+        try:
+            # 构建请求体时需要下载和编码图片，放到线程中执行以免阻塞其他请求
+            request_body = await asyncio.to_thread(build_body)
         except Exception as e:
             print(f"❌ API调用失败: {str(e)}")
             return None
+        
+        for attempt in range(MAX_RETRIES + 1):
+            stream = None
+            try:
+                # 单次估算超过TPM上限时按上限占用，否则永远无法获得额度；每次重试都是新请求，重新占用额度
+                await self.tpm_limiter.acquire(min(estimated_tokens, self.tpm_limiter.max_rate))
+                await self.rpm_limiter.acquire()
+                
+                stream = await self.client.chat.completions.create(**request_body, stream=True)
+                
+                # 流式接收，JSON对象一闭合就关闭连接并交给后续验证，不必等模型输出结束
+                tracker = JSONObjectTracker()
+                parts = []
+                async with stream:
+                    async for chunk in stream:
+                        text = chunk.choices[0].delta.content if chunk.choices else None
+                        if not text:
+                            continue
+                        end = tracker.feed(text)
+                        if end >= 0:
+                            parts.append(text[:end])
+                            break
+                        parts.append(text)
+                
+                return ''.join(parts).strip()
+                
+            except APIError as e:
+                if stream is None:
+                    # 建立请求时的错误客户端已经按状态码重试过
+                    retryable = not isinstance(e, APIStatusError) or e.status_code in (408, 409, 429) or e.status_code >= 500
+                    print(f"❌ API调用失败（{f'重试{MAX_RETRIES}次后仍失败' if retryable else '不可重试的错误'}）: {e.message}")
+                    return None
+                # 流已建立（HTTP 200）后的连接中断、超时和服务端发来的error事件都重新请求
+                if attempt == MAX_RETRIES:
+                    print(f"❌ API调用失败（重试{MAX_RETRIES}次后仍失败）: {e.message}")
+                    return None
+                delay = min(STREAM_RETRY_BASE_DELAY * 2 ** attempt, STREAM_RETRY_MAX_DELAY) * random.uniform(0.5, 1)
+                print(f"⚠️ 流式接收中断，{delay:.1f}秒后重新请求 ({attempt + 1}/{MAX_RETRIES}): {e.message}")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                print(f"❌ API调用失败: {str(e)}")
+                return None
     
-    def generate_single_qa(self, query_id: str, images: list) -> dict:
+    async def generate_single_qa(self, query_id: str, images: list) -> dict:
         """生成单个QA对"""
         try:
             # 分割图片
-            input_images, output_images = self.split_images_for_qa(images)
+            input_images, output_images = self.split_images_for_qa(images, query_id)
             
             print(f"   📊 查询 {query_id}: {len(input_images)}张输入图片, {len(output_images)}张输出图片")
             
             # 创建prompt
             prompt = self.create_prompt(input_images, output_images, query_id)
             
-            # 调用API
-            response = self.call_openai_api(prompt, input_images)
+            # 优先使用本地缓存，未命中再调用API
+            cache_key = self.make_cache_key(prompt, input_images)
+            response = self.load_cached_response(cache_key)
+            if response:
+                print(f"   💾 查询 {query_id}: 命中本地缓存")
+            else:
+                response = await self.call_openai_api(prompt, input_images)
             
             if response:
-                try:
-                    qa_data = json.loads(response)
-                    
-                    # 验证生成的数据结构
-                    if self.validate_qa_structure(qa_data, input_images, output_images):
-                        # 立即保存到文件
-                        self.save_single_qa(qa_data)
-                        print(f"   ✅ 成功生成QA对，已保存")
-                        return qa_data
-                    else:
-                        print(f"   ❌ 查询 {query_id}: 生成的数据结构不符合要求")
-                        return None
-                except json.JSONDecodeError as e:
-                    print(f"   ❌ 查询 {query_id}: JSON解析失败: {e}")
-                    return None
+                return self.handle_response(query_id, response, input_images, output_images, cache_key)
             else:
                 print(f"   ❌ 查询 {query_id}: API调用失败")
                 return None
@@ -208,22 +632,130 @@ Output images (remaining {len(output_images)} images): {[self.generate_github_ur
             print(f"   ❌ 查询 {query_id}: 处理失败: {e}")
             return None
     
-    def validate_qa_structure(self, qa_data: dict, input_images: list, output_images: list) -> bool:
-        """验证生成的QA数据结构"""
+    async def generate_group_qa(self, group: list) -> list:
+        """
+        在一次API调用中为多个查询生成QA对，命中本地缓存的查询不再发送
+        
+        Args:
+            group: (query_id, images) 列表
+            
+        Returns:
+            与group顺序对应的QA对列表，失败的项为None
+        """
+        results = [None] * len(group)
         try:
-            # 检查必需的字段
-            required_fields = ['domain', 'subdomain', 'id', 'input', 'output']
-            for field in required_fields:
-                if field not in qa_data:
-                    return False
+            pending = []
+            for index, (query_id, images) in enumerate(group):
+                input_images, output_images = self.split_images_for_qa(images, query_id)
+                print(f"   📊 查询 {query_id}: {len(input_images)}张输入图片, {len(output_images)}张输出图片")
+                
+                prompt = self.create_prompt(input_images, output_images, query_id)
+                cache_key = self.make_cache_key(prompt, input_images)
+                response = self.load_cached_response(cache_key)
+                if response:
+                    print(f"   💾 查询 {query_id}: 命中本地缓存")
+                    results[index] = self.handle_response(query_id, response, input_images, output_images, cache_key)
+                else:
+                    pending.append((index, query_id, prompt, input_images, output_images, cache_key))
             
-            # 检查input结构
-            if 'modal' not in qa_data['input'] or 'content' not in qa_data['input']:
-                return False
+            if not pending:
+                return results
             
-            # 检查output结构
-            if 'modal' not in qa_data['output'] or 'content' not in qa_data['output']:
-                return False
+            # 缓存键仍按单个查询的完整prompt计算，请求中只发送精简后的查询信息
+            items = [
+                (query_id, self.create_group_query(n, query_id, input_images, output_images), input_images)
+                for n, (_, query_id, _, input_images, output_images, _) in enumerate(pending, 1)
+            ]
+            max_tokens = min(MAX_TOKENS * len(items), MAX_OUTPUT_TOKENS)
+            response = await self.request_completion(
+                functools.partial(self.build_group_request_body, items),
+                self.estimate_tokens(GROUP_INSTRUCTIONS + ''.join(query_text for _, query_text, _ in items), max_tokens)
+            )
+            
+            # 每个查询单独验证、保存和写缓存，之后的运行仍可按单个查询命中
+            item_responses = split_group_response(response, [query_id for query_id, _, _ in items])
+            for (index, query_id, _, input_images, output_images, cache_key), item_response in zip(pending, item_responses):
+                if item_response is None:
+                    print(f"   ❌ 查询 {query_id}: {'合并请求的响应中缺少该项' if response else 'API调用失败'}")
+                    continue
+                results[index] = self.handle_response(query_id, item_response, input_images, output_images, cache_key)
+            
+        except Exception as e:
+            print(f"   ❌ 查询 {', '.join(query_id for query_id, _ in group)}: 处理失败: {e}")
+        
+        return results
+    
+    def handle_response(self, query_id: str, response: str, input_images: list, output_images: list,
+                        cache_key: str = None) -> dict:
+        """解析并验证API返回的QA对，通过后交给写入协程保存，并在传入cache_key时写入本地缓存"""
+        try:
+            qa_data = orjson.loads(response)
+            
+            # 验证生成的数据结构
+            if self.validate_qa_structure(qa_data, input_images, output_images):
+                if self.save_queue is not None:
+                    self.save_queue.put_nowait((qa_data, response, cache_key))
+                else:
+                    self.save_result(qa_data, response, cache_key)
+                print(f"   ✅ 查询 {query_id}: 成功生成QA对")
+                return qa_data
+            else:
+                print(f"   ❌ 查询 {query_id}: 生成的数据结构不符合要求")
+                return None
+        except orjson.JSONDecodeError as e:
+            print(f"   ❌ 查询 {query_id}: JSON解析失败: {e}")
+            return None
+    
+    def save_result(self, qa_data: dict, response: str, cache_key: str = None):
+        """保存通过验证的QA对到输出文件，并在传入cache_key时写入本地缓存（先写记录，缓存写入失败不影响记录）"""
+        self.save_single_qa(qa_data)
+        if cache_key:
+            try:
+                self.save_cached_response(cache_key, response)
+            except sqlite3.Error as e:
+                print(f"⚠️ 查询 {qa_data.get('id')}: 写入本地缓存失败: {e}")
+    
+    def start_writer(self):
+        """启动写入协程，之后通过验证的QA对只放入队列，文件和缓存写入不再阻塞事件循环"""
+        self.save_queue = asyncio.Queue()
+        self.writer_task = asyncio.create_task(self.write_results())
+    
+    async def stop_writer(self):
+        """等待队列中剩余的QA对写完后停止写入协程"""
+        await self.save_queue.put(None)
+        await self.writer_task
+        self.save_queue = None
+        self.writer_task = None
+    
+    async def write_results(self):
+        """写入协程：每次取出队列中已有的全部QA对，在线程中一起写入，直到取到None"""
+        while True:
+            items = [await self.save_queue.get()]
+            while not self.save_queue.empty():
+                items.append(self.save_queue.get_nowait())
+            
+            done = None in items
+            items = [item for item in items if item is not None]
+            try:
+                await asyncio.to_thread(self.save_results, items)
+            except Exception as e:
+                print(f"❌ 保存失败: {e}")
+            if done:
+                break
+    
+    def save_results(self, items: list):
+        """依次保存 (qa_data, response, cache_key) 列表，单条失败不影响同批的其他QA对"""
+        for qa_data, response, cache_key in items:
+            try:
+                self.save_result(qa_data, response, cache_key)
+            except Exception as e:
+                print(f"❌ 查询 {qa_data.get('id')}: 保存失败: {e}")
+    
+    def validate_qa_structure(self, qa_data: dict, input_images: list, output_images: list) -> bool:
+        """验证生成的QA数据结构"""
+        try:
+            # 检查必需的字段以及input/output结构
+            _validate_qa_schema(qa_data)
             
             # 检查图片数量是否匹配
             input_modal_count = len(qa_data['input']['modal'])
@@ -235,12 +767,61 @@ Output images (remaining {len(output_images)} images): {[self.generate_github_ur
             
             return True
             
+        except fastjsonschema.JsonSchemaException as e:
+            print(f"   ⚠️  结构验证失败: {e.message}")
+            return False
         except Exception:
             return False
     
-    def generate_qa_by_ids(self, query_ids: list) -> list:
-        """根据指定的查询ID列表生成QA对"""
-        print(f"🚀 开始生成 {len(query_ids)} 个多图化学QA对...")
+    async def prefetch_images(self, query_ids: list, image_mapping: dict):
+        """
+        在发送QA请求前并发下载并编码所有需要内联的输入图片，预热_encode_image的缓存
+        
+        已命中响应缓存的查询不需要图片，跳过；下载失败的图片在构建请求时会重试一次，仍失败则退回URL
+        """
+        urls = set()
+        for query_id in query_ids:
+            input_images, output_images = self.split_images_for_qa(image_mapping[query_id], query_id)
+            prompt = self.create_prompt(input_images, output_images, query_id)
+            if self.load_cached_response(self.make_cache_key(prompt, input_images)):
+                continue
+            urls.update(self.url_by_name[img] for img in input_images)
+        
+        if not urls:
+            return
+        
+        print(f"🖼️  预取 {len(urls)} 张输入图片...")
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        
+        async def fetch(url: str):
+            async with semaphore:
+                return await asyncio.to_thread(_encode_image, url)
+        
+        results = await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+        failed_count = sum(1 for result in results if isinstance(result, Exception))
+        if failed_count:
+            print(f"   ⚠️  {failed_count} 张图片预取失败")
+    
+    def filter_query_ids(self, query_ids: list, image_mapping: dict) -> list:
+        """一次性找出映射中不存在或图片不足2张的查询并统一提示，返回可处理的查询ID（保持原顺序）"""
+        missing = set(query_ids) - image_mapping.keys()
+        too_few = {query_id for query_id in query_ids if query_id not in missing and len(image_mapping[query_id]) < 2}
+        
+        if missing:
+            print(f"   ❌ 在映射文件中未找到 {len(missing)} 个查询: {sorted(missing)}")
+        for query_id in sorted(too_few):
+            print(f"   ❌ 查询 {query_id}: 图片数量不足({len(image_mapping[query_id])}张)，至少需要2张")
+        
+        return [query_id for query_id in query_ids if query_id not in missing and query_id not in too_few]
+    
+    async def generate_qa_by_ids(self, query_ids: list, concurrency: int = DEFAULT_CONCURRENCY,
+                                 group_size: int = 1) -> list:
+        """
+        根据指定的查询ID列表并发生成QA对，最多同时进行concurrency个API请求
+        
+        group_size大于1时每次请求合并最多group_size个查询，把RPM压力转为TPM
+        """
+        print(f"🚀 开始生成 {len(query_ids)} 个多图化学QA对 (最大并发: {concurrency})...")
         
         # 加载图片映射
         image_mapping = self.load_image_mapping()
@@ -250,57 +831,195 @@ Output images (remaining {len(output_images)} images): {[self.generate_github_ur
         
         print(f"✅ 加载了 {len(image_mapping)} 个查询的图片映射")
         
+        valid_ids = self.filter_query_ids(query_ids, image_mapping)
+        
+        await self.prefetch_images(valid_ids, image_mapping)
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def bounded(i: int, query_id: str) -> dict:
+            images = image_mapping[query_id]
+            async with semaphore:
+                print(f"\n📋 处理 {i+1}/{len(valid_ids)}: 查询 {query_id} (共{len(images)}张图片)")
+                
+                # 生成QA对
+                return await self.generate_single_qa(query_id, images)
+        
+        async def bounded_group(i: int, group: list) -> list:
+            async with semaphore:
+                print(f"\n📋 处理合并请求 {i+1}/{len(groups)}: 查询 {', '.join(group)}")
+                return await self.generate_group_qa([(query_id, image_mapping[query_id]) for query_id in group])
+        
+        # 保存由单独的写入协程完成，请求协程验证通过后只需放入队列
+        self.start_writer()
+        try:
+            if group_size > 1:
+                input_counts = {
+                    query_id: len(self.split_images_for_qa(image_mapping[query_id], query_id)[0])
+                    for query_id in valid_ids
+                }
+                groups = pack_query_groups(valid_ids, input_counts, group_size)
+                print(f"📦 {len(valid_ids)} 个查询合并为 {len(groups)} 个请求")
+                group_results = await asyncio.gather(*(bounded_group(i, group) for i, group in enumerate(groups)))
+                results = [qa_data for group_result in group_results for qa_data in group_result]
+            else:
+                results = await asyncio.gather(*(bounded(i, query_id) for i, query_id in enumerate(valid_ids)))
+        finally:
+            await self.stop_writer()
+        
+        qa_pairs = [qa_data for qa_data in results if qa_data]
+        successful_count = len(qa_pairs)
+        failed_count = len(query_ids) - successful_count
+        
+        print(f"\n📊 生成完成统计:")
+        print(f"   ✅ 成功: {successful_count}")
+        print(f"   ❌ 失败: {failed_count}")
+        print(f"   📈 成功率: {successful_count/len(query_ids)*100:.1f}%")
+        
+        return qa_pairs
+    
+    async def generate_qa_by_batch_api(self, query_ids: list, batch_id: str = None, poll_interval: int = 60) -> list:
+        """
+        通过OpenAI Batch API离线生成QA对（费用约为实时调用的一半，24小时内完成）
+        
+        custom_id记录为"查询ID:分割点"，恢复轮询已提交的batch时据此还原输入/输出图片的划分
+        
+        Args:
+            query_ids: 查询ID列表，batch_id不为空时忽略
+            batch_id: 已提交的batch ID，传入时跳过提交，直接继续轮询
+            poll_interval: 轮询batch状态的间隔(秒)
+        """
+        # 加载图片映射
+        image_mapping = self.load_image_mapping()
+        if not image_mapping:
+            print("❌ 无法加载图片映射")
+            return []
+        
+        print(f"✅ 加载了 {len(image_mapping)} 个查询的图片映射")
+        
         qa_pairs = []
-        successful_count = 0
         failed_count = 0
+        result_lines = []
         
-        for i, query_id in enumerate(query_ids):
-            if query_id not in image_mapping:
-                print(f"\n📋 处理 {i+1}/{len(query_ids)}: 查询 {query_id}")
-                print(f"   ❌ 查询 {query_id}: 在映射文件中未找到")
-                failed_count += 1
-                continue
+        if batch_id is None:
+            valid_ids = self.filter_query_ids(query_ids, image_mapping)
+            failed_count += len(query_ids) - len(valid_ids)
             
-            images = image_mapping[query_id]
-            if len(images) < 2:
-                print(f"\n📋 处理 {i+1}/{len(query_ids)}: 查询 {query_id}")
-                print(f"   ❌ 查询 {query_id}: 图片数量不足({len(images)}张)，至少需要2张")
-                failed_count += 1
-                continue
+            await self.prefetch_images(valid_ids, image_mapping)
+            
+            # 构建请求，命中本地缓存的查询无需提交
+            batch_requests = []
+            for query_id in valid_ids:
+                images = image_mapping[query_id]
+                input_images, output_images = self.split_images_for_qa(images, query_id)
+                prompt = self.create_prompt(input_images, output_images, query_id)
+                cache_key = self.make_cache_key(prompt, input_images)
+                response = self.load_cached_response(cache_key)
+                if response:
+                    print(f"   💾 查询 {query_id}: 命中本地缓存")
+                    qa_data = self.handle_response(query_id, response, input_images, output_images)
+                    if qa_data:
+                        qa_pairs.append(qa_data)
+                    else:
+                        failed_count += 1
+                    continue
+                
+                batch_requests.append({
+                    "custom_id": f"{query_id}:{len(input_images)}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self.build_request_body(prompt, input_images)
+                })
+            
+            if not batch_requests:
+                if not qa_pairs:
+                    print("❌ 没有可提交的查询")
+                return qa_pairs
+            
+            # 写入请求文件并提交batch
+            with open(BATCH_REQUESTS_FILE, 'wb') as f:
+                for request in batch_requests:
+                    f.write(orjson.dumps(request) + b'\n')
             
-            print(f"\n📋 处理 {i+1}/{len(query_ids)}: 查询 {query_id} (共{len(images)}张图片)")
+            with open(BATCH_REQUESTS_FILE, 'rb') as f:
+                batch_file = await self.client.files.create(file=f, purpose="batch")
+            batch = await self.client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
+            print(f"📤 已提交 {len(batch_requests)} 个请求, batch ID: {batch.id}")
+        else:
+            batch = await self.client.batches.retrieve(batch_id)
+            print(f"🔁 继续轮询 batch ID: {batch.id}")
+        
+        # 轮询直到batch结束
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            counts = batch.request_counts
+            if counts:
+                print(f"   ⏳ 状态: {batch.status} ({counts.completed}/{counts.total})，{poll_interval}秒后重试...")
+            else:
+                print(f"   ⏳ 状态: {batch.status}，{poll_interval}秒后重试...")
+            await asyncio.sleep(poll_interval)
+            batch = await self.client.batches.retrieve(batch.id)
+        
+        if batch.status != "completed":
+            print(f"❌ Batch未完成, 状态: {batch.status}")
+            return qa_pairs
+        
+        # 下载结果
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                result_file = await self.client.files.content(file_id)
+                result_lines.extend(result_file.text.splitlines())
+        
+        for line in result_lines:
+            result = orjson.loads(line)
+            query_id, split_point = result['custom_id'].rsplit(':', 1)
+            result_response = result.get('response') or {}
             
-            # 生成QA对
-            qa_data = self.generate_single_qa(query_id, images)
+            if result.get('error') or result_response.get('status_code') != 200:
+                error = result.get('error') or result_response.get('body', {}).get('error')
+                print(f"   ❌ 查询 {query_id}: 请求失败: {error}")
+                failed_count += 1
+                continue
             
+            images = image_mapping.get(query_id, [])
+            split_point = int(split_point)
+            input_images, output_images = images[:split_point], images[split_point:]
+            cache_key = self.make_cache_key(self.create_prompt(input_images, output_images, query_id), input_images)
+            response = result_response['body']['choices'][0]['message']['content'].strip()
+            qa_data = self.handle_response(query_id, response, input_images, output_images, cache_key)
             if qa_data:
                 qa_pairs.append(qa_data)
-                successful_count += 1
-                print(f"   ✅ 成功生成QA对")
             else:
                 failed_count += 1
-                print(f"   ❌ 生成失败")
-            
-            # 添加延迟避免API限制
-            if i < len(query_ids) - 1:
-                delay_seconds = 8  # 可以调整这个值
-                print(f"   ⏳ 等待{delay_seconds}秒后继续...")
-                time.sleep(delay_seconds)
         
         print(f"\n📊 生成完成统计:")
-        print(f"   ✅ 成功: {successful_count}")
+        print(f"   ✅ 成功: {len(qa_pairs)}")
         print(f"   ❌ 失败: {failed_count}")
-        print(f"   📈 成功率: {successful_count/len(query_ids)*100:.1f}%")
         
         return qa_pairs
     
+    def get_output_file(self, output_file: str):
+        """获取输出文件的追加写入句柄，首次使用时打开"""
+        if output_file not in self.output_files:
+            self.output_files[output_file] = open(output_file, 'ab', buffering=1 << 20)
+        return self.output_files[output_file]
+    
+    def close_output_files(self):
+        """关闭所有输出文件句柄"""
+        for f in self.output_files.values():
+            f.close()
+        self.output_files.clear()
+    
     def save_single_qa(self, qa_data: dict, output_file: str = "chemistry_qa_pairs.jsonl"):
-        """立即保存单个QA对到JSONL文件（追加模式，格式化JSON）"""
+        """立即保存单个QA对到JSONL文件（追加模式，每行一条紧凑JSON）"""
         try:
-            with open(output_file, 'a', encoding='utf-8') as f:
-                # 写入格式化的JSON，每个case占多行，便于阅读
-                formatted_json = json.dumps(qa_data, ensure_ascii=False, indent=2)
-                f.write(formatted_json + '\n')
+            f = self.get_output_file(output_file)
+            f.write(orjson.dumps(qa_data) + b'\n')
+            # 每条记录写完即刷新，中途中断也不会丢失已生成的QA对
+            f.flush()
             
             return True
         except Exception as e:
@@ -308,13 +1027,11 @@ Output images (remaining {len(output_images)} images): {[self.generate_github_ur
             return False
     
     def save_qa_pairs(self, qa_pairs: list, output_file: str = "chemistry_qa_pairs.jsonl"):
-        """保存QA对到JSONL文件（追加模式，格式化JSON）"""
+        """保存QA对到JSONL文件（追加模式，每行一条紧凑JSON）"""
         try:
-            with open(output_file, 'a', encoding='utf-8') as f:
+            with open(output_file, 'ab') as f:
                 for qa_pair in qa_pairs:
-                    # 写入格式化的JSON，每个case占多行，便于阅读
-                    formatted_json = json.dumps(qa_pair, ensure_ascii=False, indent=2)
-                    f.write(formatted_json + '\n')
+                    f.write(orjson.dumps(qa_pair) + b'\n')
             
             print(f"💾 QA对已追加保存到: {output_file}")
             return True
@@ -322,8 +1039,67 @@ Output images (remaining {len(output_images)} images): {[self.generate_github_ur
             print(f"❌ 保存失败: {e}")
             return False
 
+def export_pretty_json(jsonl_file: str = "chemistry_qa_pairs.jsonl", output_file: str = None):
+    """
+    把JSONL文件导出为格式化的JSON数组，便于人工查看
+    
+    Args:
+        jsonl_file: 每行一条QA对的JSONL文件
+        output_file: 输出文件，默认与输入同名的.pretty.json
+    """
+    if output_file is None:
+        output_file = os.path.splitext(jsonl_file)[0] + ".pretty.json"
+    
+    try:
+        qa_pairs = []
+        skipped_count = 0
+        with open(jsonl_file, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    qa_pairs.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    # 旧版本写入的多行格式化记录无法按行解析
+                    skipped_count += 1
+        
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(qa_pairs, option=orjson.OPT_INDENT_2) + b'\n')
+        
+        print(f"💾 已导出 {len(qa_pairs)} 个QA对到: {output_file}")
+        if skipped_count:
+            print(f"⚠️  跳过 {skipped_count} 行无法解析的内容")
+    except FileNotFoundError:
+        print(f"❌ 找不到文件: {jsonl_file}")
+
+def positive_int(value: str) -> int:
+    """argparse类型：正整数（轮询间隔为0时会不停请求Batch API）"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"需要正整数，得到: {value}")
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"需要正整数，得到: {value}")
+    return number
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="批量生成多图化学QA对（文+图 -> 文+图）")
+    parser.add_argument("--batch", action="store_true", help="通过OpenAI Batch API离线生成（费用减半，24小时内完成）")
+    parser.add_argument("--batch-id", help="继续轮询已提交的batch并保存结果")
+    parser.add_argument("--poll-interval", type=positive_int, default=60, help="轮询batch状态的间隔秒数 (默认: 60)")
+    parser.add_argument("--export-pretty", nargs="?", const="chemistry_qa_pairs.jsonl", metavar="JSONL",
+                        help="把JSONL导出为格式化的.pretty.json后退出 (默认: chemistry_qa_pairs.jsonl)")
+    return parser.parse_args()
+
 def main():
     """主函数"""
+    args = parse_args()
+    
+    if args.export_pretty:
+        export_pretty_json(args.export_pretty)
+        return
+    
     print("🧪 多图化学QA对生成器 v2 (基于映射文件)")
     print("=" * 60)
     
@@ -332,8 +1108,24 @@ def main():
         print("❌ 未找到OpenAI API密钥，请检查config.env文件")
         return
     
+    if args.batch_id:
+        # 恢复已提交的batch，无需重新输入查询ID
+        generator = MultiImageQAGeneratorV2()
+        asyncio.run(generator.generate_qa_by_batch_api([], args.batch_id, args.poll_interval))
+        return
+    
+    if args.batch:
+        # Batch API不受实时接口的RPM/TPM限制
+        rpm, tpm = DEFAULT_RPM, DEFAULT_TPM
+    else:
+        # 账户限流配置
+        rpm = input(f"每分钟最大请求数 RPM (默认: {DEFAULT_RPM}): ").strip()
+        tpm = input(f"每分钟最大token数 TPM (默认: {DEFAULT_TPM}): ").strip()
+        rpm = int(rpm) if rpm.isdigit() and int(rpm) > 0 else DEFAULT_RPM
+        tpm = int(tpm) if tpm.isdigit() and int(tpm) > 0 else DEFAULT_TPM
+    
     # 创建生成器
-    generator = MultiImageQAGeneratorV2()
+    generator = MultiImageQAGeneratorV2(rpm=rpm, tpm=tpm)
     
     # 获取用户输入
     print("请输入要生成QA对的查询ID:")
@@ -363,11 +1155,22 @@ def main():
         print("❌ 查询ID格式错误")
         return
     
+    # 去掉重复的查询ID，保持输入顺序
+    query_ids = list(dict.fromkeys(query_ids))
+    
     print(f"\n🎯 配置信息:")
     print(f"   - 查询ID数量: {len(query_ids)}")
     print(f"   - 查询ID列表: {query_ids[:10]}{'...' if len(query_ids) > 10 else ''}")
     print(f"   - 映射文件: {generator.mapping_file}")
     print(f"   - GitHub基础URL: {generator.github_base_url}")
+    if args.batch:
+        print(f"   - 模式: OpenAI Batch API (离线)")
+    else:
+        print(f"   - 限流: {rpm} RPM, {tpm} TPM")
+        concurrency = input(f"最大并发请求数 (默认: {DEFAULT_CONCURRENCY}): ").strip()
+        concurrency = int(concurrency) if concurrency.isdigit() and int(concurrency) > 0 else DEFAULT_CONCURRENCY
+        group_size = input("每次请求合并的查询数 (默认: 1): ").strip()
+        group_size = int(group_size) if group_size.isdigit() and int(group_size) > 0 else 1
     
     confirm = input(f"\n确认开始生成? (y/N): ").strip().lower()
     if confirm != 'y':
@@ -376,7 +1179,10 @@ def main():
     
     # 生成QA对
     start_time = time.time()
-    qa_pairs = generator.generate_qa_by_ids(query_ids)
+    if args.batch:
+        qa_pairs = asyncio.run(generator.generate_qa_by_batch_api(query_ids, poll_interval=args.poll_interval))
+    else:
+        qa_pairs = asyncio.run(generator.generate_qa_by_ids(query_ids, concurrency, group_size))
     end_time = time.time()
     
     if qa_pairs: